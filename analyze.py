@@ -0,0 +1,311 @@
+import constants as c
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from blink import GapFiller
+from calibstore import mean, noise, pixels_per_cm, with_defaults
+from fixation import FixationDetector, FIXATION_END, DWELL, EVENT_KINDS
+from gazebuffer import gaze_points
+from sessionlog import Session, SAMPLES, EVENTS, COMMANDS, GAME, GAME_KINDS
+from velocity import VelocityClassifier, SACCADE
+import gazestats
+
+# bump when the analysis changes, so cached results are recomputed
+VERSION = 4
+
+COLUMNS = (
+    'session', 'player', 'duration_s', 'samples', 'samplerate', 'dropped', 'tracked',
+    'blinks', 'blink_rate', 'blink_ms',
+    'fixations', 'fixation_rate', 'fixation_ms', 'dwells', 'live_fixations', 'saccade',
+    'precision_px', 'precision_deg',
+    'games', 'apples', 'crashes', 'max_length', 'turns',
+)
+
+
+def parameters(config):
+    '''
+    Everything besides the session file that the results depend on: the
+    thresholds of `config` (as in Calibrator.config) and the constants the
+    live pipeline is built with
+    '''
+    return OrderedDict([
+        ('version', VERSION),
+        ('config', OrderedDict(sorted(config.items()))),
+        ('dispsize', list(c.DISPSIZE)),
+        ('screensize', list(c.SCREENSIZE)),
+        ('screendist', c.SCREENDIST),
+        ('dwelltime', c.DWELLTIME),
+        ('dwellalpha', c.DWELLALPHA),
+    ])
+
+
+def _key(path, params):
+    # changes with the file (size and modification time) and the parameters
+    stat = os.stat(path)
+    state = json.dumps([stat.st_size, stat.st_mtime_ns, params])
+    return hashlib.sha1(state.encode()).hexdigest()
+
+
+def replay(t, x, y, config):
+    '''
+    Run recorded gaze through the stages Tracker runs live, wired the same
+    way: GapFiller, then VelocityClassifier and FixationDetector on every
+    valid or interpolated point, with blinks resetting both.
+
+    param `t`: sample times in milliseconds
+    param `x`, `y`: gaze position in pixels, NaN where neither eye was tracked
+
+    Returns the fixation events, the blinks and the number of saccade samples.
+    '''
+    events, blinks = [], []
+    detector = FixationDetector(config['pxfixtresh'], config['fixtimetresh'],
+                                mindwell=c.DWELLTIME, dwellalpha=c.DWELLALPHA,
+                                noise=noise(config['pxdsttresh']))
+    detector.subscribe(events.append)
+    classifier = VelocityClassifier(config['pxspdtresh'], config['pxacctresh'])
+    saccades = [0]
+
+    def process_point(t, x, y):
+        if classifier.feed(t * 1000.0, x, y) == SACCADE:
+            saccades[0] += 1
+        detector.feed(t, x, y)
+
+    def on_blink(event):
+        blinks.append(event)
+        classifier.reset()
+        detector.interrupt(event.stime)
+
+    gap_filler = GapFiller(config['blinkthresh'], process_point)
+    gap_filler.subscribe(on_blink)
+    feed = gap_filler.feed
+    for sample in zip(t.tolist(), x.tolist(), y.tolist()):
+        feed(*sample)
+    return events, blinks, saccades[0]
+
+
+def _precision(t, x, y, fixations):
+    # median over fixations of the sample-to-sample RMS noise inside them, in pixels
+    starts = np.searchsorted(t, [event.stime for event in fixations], side='left')
+    ends = np.searchsorted(t, [event.etime for event in fixations], side='left')
+    rms = []
+    for start, end in zip(starts, ends):
+        fx, fy = x[start:end], y[start:end]
+        valid = np.isfinite(fx) & np.isfinite(fy)
+        if valid.sum() > 1:
+            rms.append(math.hypot(*gazestats.rms_noise(fx[valid], fy[valid])))
+    return float(np.median(rms)) if rms else math.nan
+
+
+def _game(session, player):
+    game = session.load(GAME, player, columns=('kind', 'length'))
+    kinds = game['kind']
+    # new games and apples are recorded once for the board, as player 0's
+    board = session.load(GAME, 0, columns=('kind',))['kind']
+    commands = session.load(COMMANDS, player, columns=('t',))['t']
+    return OrderedDict([
+        ('games', int((board == GAME_KINDS.index('new_game')).sum())),
+        ('apples', int((kinds == GAME_KINDS.index('eat')).sum())),
+        ('crashes', int((kinds == GAME_KINDS.index('crash')).sum())),
+        ('max_length', int(game['length'].max()) if len(kinds) else 0),
+        ('turns', len(commands)),
+    ])
+
+
+def analyze_player(session, player, config):
+    samples = session.load(SAMPLES, player)
+    timestamps = samples['system_time_stamp']
+    t = timestamps / 1000.0
+    x, y = gaze_points(samples, c.DISPSIZE)
+    events, blinks, saccades = replay(t, x, y, config)
+
+    fixations = [event for event in events if event.kind == FIXATION_END]
+    dwells = sum(1 for event in events if event.kind == DWELL)
+    live = session.load(EVENTS, player, columns=('kind',))['kind']
+    timing = gazestats.sample_timing(gazestats.intersample_intervals(timestamps))
+    minutes = (t[-1] - t[0]) / 60000.0 if len(t) > 1 else 0.0
+    tracked = np.isfinite(x) & np.isfinite(y)
+
+    pixpercm = pixels_per_cm()
+    precision = _precision(t, x, y, fixations)
+
+    row = OrderedDict([
+        ('session', session.path),
+        ('player', player),
+        ('duration_s', minutes * 60),
+        ('samples', len(t)),
+        ('samplerate', timing['samplerate']),
+        ('dropped', timing['dropped']),
+        ('tracked', float(tracked.mean()) if len(t) else 0.0),
+        ('blinks', len(blinks)),
+        ('blink_rate', len(blinks) / minutes if minutes else 0.0),
+        ('blink_ms', mean([blink.etime - blink.stime for blink in blinks])),
+        ('fixations', len(fixations)),
+        ('fixation_rate', len(fixations) / minutes if minutes else 0.0),
+        ('fixation_ms', mean([event.etime - event.stime for event in fixations])),
+        ('dwells', dwells),
+        ('live_fixations', int((live == EVENT_KINDS.index(FIXATION_END)).sum())),
+        ('saccade', saccades / float(tracked.sum()) if tracked.any() else 0.0),
+        ('precision_px', precision),
+        ('precision_deg', float(gazestats.pix2deg(c.SCREENDIST, precision, pixpercm))),
+    ])
+    row.update(_game(session, player))
+    return row
+
+
+def analyze_session(path, config):
+    '''
+    One summary row per player of the session file at `path`, computed
+    with the thresholds of `config`
+    '''
+    session = Session(path)
+    players = sorted(set(session.players(SAMPLES)) | set(session.players(EVENTS)) | set(session.players(GAME)))
+    return [analyze_player(session, player, config) for player in players]
+
+
+class ResultCache(object):
+    '''
+    Rows of every session analyzed before, keyed by session path, with the
+    key of the file state and parameters they were computed from. Kept as
+    one JSON file.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as infile:
+                self.entries = json.load(infile)
+
+    def get(self, session, key):
+        entry = self.entries.get(session)
+        if entry is not None and entry['key'] == key:
+            return entry['rows']
+        return None
+
+    def put(self, session, key, rows):
+        self.entries[session] = {'key': key, 'rows': rows}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path + '.tmp', 'w') as outfile:
+            json.dump(self.entries, outfile, default=float)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def analyze(paths, config, cache=None, jobs=None):
+    '''
+    Analyze the session files `paths` across a pool of `jobs` processes
+    (default: one per core) and return their rows in the order of `paths`.
+
+    Sessions whose file and parameters match an entry of `cache` are not
+    read again. Returns the rows, the number of sessions analyzed and the
+    paths that failed with the reason.
+    '''
+    config = with_defaults(config)
+    params = parameters(config)
+    results = OrderedDict((os.path.abspath(path), None) for path in paths)
+    keys, failed = {}, []
+    for path in results:
+        try:
+            keys[path] = _key(path, params)
+        except OSError as error:
+            # missing or unreadable; report it with the sessions that fail to load
+            failed.append((path, '%s: %s' % (type(error).__name__, error)))
+    stale = [path for path in keys if cache is None or cache.get(path, keys[path]) is None]
+    missing = len(failed)
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = dict((pool.submit(analyze_session, path, config), path) for path in stale)
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    rows = future.result()
+                except Exception as error:
+                    # one bad session must not cost the results of the others
+                    failed.append((path, '%s: %s' % (type(error).__name__, error)))
+                    continue
+                if cache is not None:
+                    cache.put(path, keys[path], rows)
+                results[path] = rows
+                if c.DEBUG: print('analyzed %s' % path)
+
+    rows = []
+    for path, fresh in results.items():
+        if path not in keys:
+            continue
+        found = fresh if fresh is not None else (cache.get(path, keys[path]) if cache is not None else None)
+        rows.extend(found or [])
+    return rows, len(stale) - (len(failed) - missing), failed
+
+
+def write_table(rows, output):
+    directory = os.path.dirname(output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(output, 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_table(rows):
+    columns = ('player', 'duration_s', 'samplerate', 'tracked', 'blink_rate', 'fixations', 'fixation_ms',
+               'precision_deg', 'games', 'apples', 'turns')
+    print('%-32s ' % 'session' + ' '.join('%13s' % column for column in columns))
+    for row in rows:
+        cells = ['%13.3f' % row[column] if isinstance(row[column], float) else '%13s' % row[column]
+                 for column in columns]
+        print('%-32s ' % os.path.basename(row['session'])[-32:] + ' '.join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recompute gaze and game statistics over recorded sessions.')
+    parser.add_argument('sessions', nargs='*', help='session files or directories (default: OUTPUT_PATH)')
+    parser.add_argument('--config', required=True,
+                        help='threshold config JSON, as Calibrator.config (e.g. CALIBRATION_PATH/<user>/<serial>.json)')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--output', help='summary table (default: OUTPUT_PATH/analysis/summary.csv)')
+    parser.add_argument('--cache', help='results cache (default: OUTPUT_PATH/analysis/cache.json)')
+    parser.add_argument('--force', action='store_true', help='reanalyze every session')
+    args = parser.parse_args(argv)
+
+    with open(args.config) as infile:
+        config = json.load(infile)
+
+    paths = []
+    for name in args.sessions or [c.OUTPUT_PATH]:
+        if os.path.isdir(name):
+            paths.extend(sorted(glob.glob(os.path.join(name, '*.session'))))
+        else:
+            paths.append(name)
+
+    cache = ResultCache(args.cache or os.path.join(c.OUTPUT_PATH, 'analysis', 'cache.json'))
+    if args.force:
+        cache.entries = {}
+    rows, analyzed, failed = analyze(paths, config, cache, args.jobs)
+    cache.save()
+
+    output = args.output or os.path.join(c.OUTPUT_PATH, 'analysis', 'summary.csv')
+    write_table(rows, output)
+    print_table(rows)
+    print('%d sessions, %d analyzed, %d unchanged; summary written to %s' % (
+        len(paths), analyzed, len(paths) - analyzed - len(failed), output))
+    for path, error in failed:
+        print('failed: %s: %s' % (path, error), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import constants as c
+
+
+def load_backend(name=None):
+    '''
+    Module providing the eye tracker API: tobii_research for real hardware,
+    or mocktracker, which implements the same surface offline. Defaults to
+    TRACKERBACKEND.
+    '''
+    if name is None:
+        name = c.TRACKERBACKEND
+    if name == 'mock':
+        import mocktracker
+        return mocktracker
+    if name == 'tobii':
+        import tobii_research
+        return tobii_research
+    raise ValueError("Unknown tracker backend '%s', expected 'tobii' or 'mock'" % name)
@@ -0,0 +1,179 @@
+import constants as c
+
+import numpy as np
+
+from steering import RIGHT, LEFT, UP, DOWN, NONE, region_table
+
+# head moves per direction, in the numbering of Player.direction
+DX = np.array([1, -1, 0, 0], dtype=np.int32)
+DY = np.array([0, 0, -1, 1], dtype=np.int32)
+OPPOSITE = np.array([LEFT, RIGHT, DOWN, UP], dtype=np.int8)
+
+
+class BatchSnake(object):
+    '''
+    Headless engine stepping `n` independent games of Snake in lockstep.
+
+    All state lives in NumPy arrays, one row per game, with cells numbered
+    y * cols + x:
+
+    - `body` is a ring of cells per game, head at `headpos`, `size` long
+    - `grid` marks the cells the snake occupies, `food` the apples
+    - `direction`, `heading` (direction of the last move), `length`,
+      `score` and `alive`
+
+    `step()` moves every live game one tick, with movement, collisions and
+    eating vectorized across games. Unlike the pygame game, the board is
+    finite: with `walls` leaving it is fatal, without it the snake wraps
+    around. Randomness (apple placement) comes from a generator seeded
+    with `seed`, so a run is reproducible from the seed and the commands.
+    '''
+    def __init__(self, n, cols=c.DISPSIZE[0] // 44, rows=c.DISPSIZE[1] // 44, length=3, apples=c.APPLES,
+                 walls=True, seed=None):
+        self.n = n
+        self.cols = cols
+        self.rows = rows
+        self.cells = cols * rows
+        self.initial_length = length
+        self.apples = apples
+        self.walls = walls
+        self.rng = np.random.default_rng(seed)
+
+        self.body = np.zeros((n, self.cells), dtype=np.int32)
+        self.headpos = np.zeros(n, dtype=np.int32)
+        self.size = np.zeros(n, dtype=np.int32)
+        self.length = np.zeros(n, dtype=np.int32)
+        self.grid = np.zeros((n, self.cells), dtype=bool)
+        self.food = np.zeros((n, self.cells), dtype=bool)
+        self.direction = np.zeros(n, dtype=np.int8)
+        self.heading = np.zeros(n, dtype=np.int8)
+        self.score = np.zeros(n, dtype=np.int32)
+        self.alive = np.zeros(n, dtype=bool)
+        self.ticks = 0
+
+        self._rows = np.arange(n)
+        self._steering = region_table(cols, rows, c.STEERINGDEADZONE)
+        self.reset()
+
+    def reset(self, games=None):
+        '''
+        Start new games: all of them, or those selected by the index or
+        boolean mask `games`. Each snake starts in the middle row at the left
+        edge, heading right.
+        '''
+        games = self._rows[games] if games is not None else self._rows
+        if not len(games):
+            return
+        k = self.initial_length
+        y = self.rows // 2
+        self.grid[games] = False
+        self.food[games] = False
+        self.body[games, :k] = y * self.cols + np.arange(k)
+        self.grid[games, y * self.cols:y * self.cols + k] = True
+        self.headpos[games] = k - 1
+        self.size[games] = k
+        self.length[games] = k
+        self.direction[games] = RIGHT
+        self.heading[games] = RIGHT
+        self.score[games] = 0
+        self.alive[games] = True
+        for i in range(self.apples):
+            self._spawn(games)
+
+    def _spawn(self, games):
+        # one apple per game in `games`, uniformly among its free cells
+        free = ~(self.grid[games] | self.food[games])
+        counts = free.sum(axis=1)
+        placed = counts > 0
+        games, free, counts = games[placed], free[placed], counts[placed]
+        if not len(games):
+            return
+        pick = (self.rng.random(len(games)) * counts).astype(np.int64)
+        cells = (np.cumsum(free, axis=1) > pick[:, None]).argmax(axis=1)
+        self.food[games, cells] = True
+
+    def heads(self):
+        # (x, y) cell of every snake's head
+        head = self.body[self._rows, self.headpos]
+        return head % self.cols, head // self.cols
+
+    def gaze_commands(self, x, y, dispsize=c.DISPSIZE):
+        '''
+        Steering command per game for gaze at display pixels (x, y), relative
+        to the snake's head as SteeringEngine does in 'head' mode; NaN gaze
+        gives NONE
+        '''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        gx = (np.where(valid, x, 0) * self.cols / dispsize[0]).astype(np.int32)
+        gy = (np.where(valid, y, 0) * self.rows / dispsize[1]).astype(np.int32)
+        hx, hy = self.heads()
+        dx = np.clip(gx - hx, -self.cols, self.cols)
+        dy = np.clip(gy - hy, -self.rows, self.rows)
+        commands = self._steering[dy + self.rows, dx + self.cols]
+
+        # gaze behind the head turns sideways, as SteeringEngine.sideways()
+        behind = commands == OPPOSITE[self.heading]
+        horizontal = self.heading <= LEFT
+        minor = np.where(horizontal, np.where(dy != 0, dy, self.rows // 2 - hy),
+                         np.where(dx != 0, dx, self.cols // 2 - hx))
+        sideways = np.where(horizontal, np.where(minor > 0, DOWN, UP), np.where(minor > 0, RIGHT, LEFT))
+        commands = np.where(behind, sideways, commands)
+        return np.where(valid, commands, NONE).astype(np.int8)
+
+    def step(self, commands=None):
+        '''
+        Advance every live game by one tick.
+
+        param `commands`: direction per game to turn to before moving (NONE
+        to keep going), or None; turning back against the heading is ignored
+
+        returns boolean arrays of the games that ate an apple and that died
+        '''
+        alive = self.alive
+        if commands is not None:
+            commands = np.asarray(commands, dtype=np.int8)
+            turn = (commands != NONE) & (commands != OPPOSITE[self.heading]) & alive
+            self.direction[turn] = commands[turn]
+
+        rows = self._rows
+        direction = self.direction
+        head = self.body[rows, self.headpos]
+        nx = head % self.cols + DX[direction]
+        ny = head // self.cols + DY[direction]
+        if self.walls:
+            out = (nx < 0) | (nx >= self.cols) | (ny < 0) | (ny >= self.rows)
+            nx = np.clip(nx, 0, self.cols - 1)
+            ny = np.clip(ny, 0, self.rows - 1)
+        else:
+            out = np.zeros(self.n, dtype=bool)
+            nx %= self.cols
+            ny %= self.rows
+        new = ny * self.cols + nx
+
+        # the tail moves out before the head moves in
+        pop = alive & ~out & (self.size >= self.length)
+        tail = self.body[rows, (self.headpos - self.size + 1) % self.cells]
+        self.grid[rows[pop], tail[pop]] = False
+        self.size[pop] -= 1
+
+        died = alive & (out | self.grid[rows, new])
+        moving = alive & ~died
+        games = rows[moving]
+        self.headpos[games] = (self.headpos[games] + 1) % self.cells
+        self.body[games, self.headpos[games]] = new[games]
+        self.grid[games, new[games]] = True
+        self.size[games] += 1
+        self.heading[games] = direction[games]
+
+        ate = moving & self.food[rows, new]
+        eaters = rows[ate]
+        self.food[eaters, new[eaters]] = False
+        self.length[eaters] += 1
+        self.score[eaters] += 1
+        self._spawn(eaters)
+
+        self.alive &= ~died
+        self.ticks += 1
+        return ate, died
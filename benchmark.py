@@ -0,0 +1,253 @@
+import constants as c
+
+# the benchmark never talks to hardware; the tracker runs on the mock backend
+c.TRACKERBACKEND = 'mock'
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pygame
+
+import mocktracker
+from fixation import DWELL, FIXATION_END
+from scheduler import FixedTimestep
+from snake import Snake
+from tracker import Tracker
+
+BENCHUSER = 'benchmark'
+RATES = (60, 120, 300, 600)
+DURATION = 30 * 60  # seconds of simulated play
+FRAMETIME = 1000.0 / c.FRAMERATE  # milliseconds, the game loop's frame period
+SEED = 1
+LENGTHS = (3,)  # snake lengths games grow to, one run per rate and length
+STAGES = ('gaze', 'direction', 'update', 'render')
+
+# thresholds as a calibration would produce them for SCREENDIST/SCREENSIZE
+BENCHCONFIG = {
+    'pxfixtresh': 83.0,
+    'fixtimetresh': 100,
+    'pxdsttresh': [2.0, 2.0],
+    'pxspdtresh': 1.9,
+    'pxacctresh': 0.526,
+    'blinkthresh': 50,
+}
+
+
+def _rss():
+    # resident set size in bytes
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _percentiles(values):
+    if not len(values):
+        return None
+    p50, p90, p99, p100 = np.percentile(values, [50, 90, 99, 100])
+    return {'p50': p50, 'p90': p90, 'p99': p99, 'max': p100, 'mean': float(np.mean(values)), 'n': len(values)}
+
+
+def run(samplerate, duration=DURATION, frametime=FRAMETIME, seed=SEED, length=LENGTHS[0]):
+    '''
+    Play `duration` simulated seconds of the game on a deterministic
+    synthetic gaze stream at `samplerate` Hz.
+
+    Simulated time drives the schedule: every frame first delivers the
+    samples recorded since the previous frame to the callback the tracker
+    subscribes with in start_recording, then drains the fixation events
+    and applies the steering command get_direction makes of them, runs
+    the on_loop ticks a FixedTimestep on simulated time says are due, and
+    renders. An event's latency is the simulated time from the sample
+    that committed it to the frame whose tick moved the snake, plus the
+    real time that frame spent before the update.
+
+    Every game's snake grows to `length` cells. The board has no
+    walls, so a game also ends when the head leaves the board; the
+    benchmark starts a new one, as it does after a collision. Stage
+    times are CPU time (process_time), frame work is wall time.
+    '''
+    trigger = DWELL if c.FIXATIONTRIGGER == 'dwell' else FIXATION_END
+    tracker = Tracker(BENCHUSER, eyetracker=mocktracker.MockEyeTracker(speed=None), config=BENCHCONFIG)
+    events = []
+    tracker.fixation_detector.subscribe(lambda event: event.kind == trigger and events.append(event))
+    if c.GAZEASDICTIONARY:
+        callback, convert = tracker._on_gaze_data, None
+    else:
+        callback, convert = tracker._on_gaze_object, mocktracker.to_object
+
+    random.seed(seed)
+    snake = Snake()
+    snake.on_init()
+    snake.player.length = length
+    scheduler = FixedTimestep()
+
+    source = iter(mocktracker.SyntheticGaze(samplerate=samplerate, seed=seed))
+    sample = next(source)
+
+    stages = dict((stage, 0) for stage in STAGES)
+    frames = []
+    commit_latency, gaze_latency = [], []
+    pending = []
+    memory = []
+    turns = 0
+    games = 1
+    left_board = 0
+    rss0 = None
+    nframes = int(duration * 1000 / frametime)
+    frames_per_minute = int(60000 / frametime)
+
+    for frame in range(1, nframes + 1):
+        tframe = frame * frametime * 1000  # microseconds
+        frame_start = time.perf_counter()
+
+        cpu0 = time.process_time()
+        while sample['system_time_stamp'] <= tframe:
+            callback(convert(sample) if convert else sample)
+            sample = next(source)
+        cpu1 = time.process_time()
+
+        drained, events[:] = events[:], []
+        command = snake.get_direction(drained) if drained else None
+        if command is not None:
+            snake.steer(command.direction)
+        pending.extend(drained)
+        cpu2 = time.process_time()
+        ticks = scheduler.advance(tframe / 1000.0)
+        for tick in range(ticks):
+            heading = snake.player.heading
+            try:
+                snake.on_loop()
+            except SystemExit:
+                # the game exits on a collision; the benchmark starts over instead
+                snake.new_game()
+            else:
+                if snake.cells.on_board(snake.player.head()):
+                    turns += snake.player.heading != heading
+                    continue
+                snake.new_game()
+                left_board += 1
+            snake.player.length = length
+            games += 1
+        update_end = time.perf_counter()
+        cpu3 = time.process_time()
+        snake.on_render()
+        cpu4 = time.process_time()
+        frame_end = time.perf_counter()
+        stages['gaze'] += cpu1 - cpu0
+        stages['direction'] += cpu2 - cpu1
+        stages['update'] += cpu3 - cpu2
+        stages['render'] += cpu4 - cpu3
+
+        if ticks:
+            applied = tframe / 1000.0 + (update_end - frame_start) * 1000
+            for event in pending:
+                commit_latency.append(applied - event.etime)
+                gaze_latency.append(applied - event.stime)
+            pending = []
+        frames.append((frame_end - frame_start) * 1000)
+
+        if frame == 1:
+            rss0 = _rss()
+        if frame % frames_per_minute == 0:
+            memory.append(_rss())
+
+    pygame.quit()
+    frames = np.array(frames)
+    return {
+        'samplerate': samplerate,
+        'duration': duration,
+        'frametime': frametime,
+        'trigger': trigger,
+        'length': length,
+        'events': len(commit_latency),
+        'turns': turns,
+        'ticks': scheduler.ticks,
+        'games': games,
+        'left_board': left_board,
+        'commit_latency_ms': _percentiles(commit_latency),
+        'gaze_latency_ms': _percentiles(gaze_latency),
+        'stage_cpu_s': stages,
+        'stage_cpu_per_frame_ms': dict((stage, 1000 * total / nframes) for stage, total in stages.items()),
+        'frame_work_ms': _percentiles(frames),
+        'frame_jitter_ms': float(frames.std()),
+        'rss_start': rss0,
+        'rss_per_minute': memory,
+        'rss_growth': (memory[-1] - rss0) if memory else 0,
+    }
+
+
+def compare(results, baseline):
+    # print the change of the headline numbers against an earlier results file
+    for key, result in sorted(results['runs'].items(), key=lambda item: (item[1]['samplerate'], item[1]['length'])):
+        old = baseline['runs'].get(key)
+        if old is None:
+            continue
+        rows = [
+            ('commit latency p50', result['commit_latency_ms'], old['commit_latency_ms'], 'p50'),
+            ('commit latency p99', result['commit_latency_ms'], old['commit_latency_ms'], 'p99'),
+            ('frame work p99', result['frame_work_ms'], old['frame_work_ms'], 'p99'),
+        ]
+        print('%s Hz, length %s (vs %s)' % (result['samplerate'], result['length'], baseline['commit']))
+        for name, new, prev, key in rows:
+            if new and prev:
+                print('  %-20s %10.3f ms -> %10.3f ms' % (name, prev[key], new[key]))
+        print('  %-20s %10d B  -> %10d B' % ('rss growth', old['rss_growth'], result['rss_growth']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gaze-to-steer latency benchmark on synthetic gaze streams.')
+    parser.add_argument('--rates', type=int, nargs='+', default=RATES, help='sample rates in Hz')
+    parser.add_argument('--duration', type=float, default=DURATION, help='simulated seconds per rate')
+    parser.add_argument('--lengths', type=int, nargs='+', default=LENGTHS, help='snake lengths games grow to')
+    parser.add_argument('--frametime', type=float, default=FRAMETIME, help='frame period in milliseconds')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--output', help='results file (default: OUTPUT_PATH/benchmarks/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    results = {
+        'commit': _commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'runs': {},
+    }
+    for rate in args.rates:
+        for length in args.lengths:
+            if c.DEBUG: print('benchmarking %s Hz, length %s for %s simulated seconds' % (rate, length, args.duration))
+            results['runs']['%d/%d' % (rate, length)] = run(rate, args.duration, args.frametime, args.seed, length)
+
+    output = args.output or os.path.join(c.OUTPUT_PATH, 'benchmarks', results['commit'] + '.json')
+    if os.path.dirname(output) and not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as outfile:
+        json.dump(results, outfile, indent=2, default=float)
+    print('results written to %s' % output)
+
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(results, json.load(infile))
+
+
+if __name__ == '__main__':
+    main()
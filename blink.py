@@ -0,0 +1,99 @@
+from collections import namedtuple
+
+import numpy as np
+import math
+
+from publisher import Publisher
+
+# stime is the timestamp of the first sample without gaze, etime that of the
+# first sample with gaze again, both in milliseconds
+BlinkEvent = namedtuple('BlinkEvent', ['stime', 'etime'])
+
+
+class GapFiller(Publisher):
+    '''
+    Streaming blink detection and gap interpolation.
+
+    Feed every sample in order, with NaN for x/y when neither eye was
+    tracked. Valid samples are passed on to `sink(t, x, y)`. A run of
+    invalid samples that lasts at most `blinkthresh` milliseconds is a
+    dropout: once gaze comes back, the missing samples are linearly
+    interpolated and passed on first, so downstream stages never see the
+    gap. Longer runs are blinks and are published to subscribers as a
+    BlinkEvent instead.
+    '''
+    def __init__(self, blinkthresh, sink):
+        self.blinkthresh = blinkthresh
+        self.sink = sink
+        Publisher.__init__(self)
+        self.reset()
+
+    def reset(self):
+        self._last = None
+        self._gapstart = None
+        self._gap = []
+
+    def feed(self, t, x, y):
+        if not (math.isfinite(x) and math.isfinite(y)):
+            if self._gapstart is None:
+                self._gapstart = t
+            if t - self._gapstart <= self.blinkthresh:
+                self._gap.append(t)
+            elif self._gap:
+                # too long to be a dropout; stop remembering timestamps
+                self._gap = []
+            return
+
+        if self._gapstart is not None:
+            if t - self._gapstart > self.blinkthresh:
+                self._emit(BlinkEvent(self._gapstart, t))
+            elif self._last is not None:
+                lt, lx, ly = self._last
+                for gt in self._gap:
+                    f = (gt - lt) / float(t - lt)
+                    self.sink(gt, lx + f * (x - lx), ly + f * (y - ly))
+            self._gapstart = None
+            self._gap = []
+
+        self._last = (t, x, y)
+        self.sink(t, x, y)
+
+
+def fill_gaps(t, x, y, blinkthresh):
+    '''
+    Bulk form of GapFiller for recorded sessions.
+
+    param `t`: timestamps in milliseconds
+    param `x`, `y`: gaze position, NaN where neither eye was tracked
+
+    Returns the filled x and y arrays and an (n, 2) array with the start
+    and end time of every blink. Gaps at the very start or end of the
+    recording are left as NaN.
+    '''
+    t = np.asarray(t, dtype=np.float64)
+    x = np.array(x, dtype=np.float64)
+    y = np.array(y, dtype=np.float64)
+
+    invalid = ~(np.isfinite(x) & np.isfinite(y))
+    edges = np.diff(invalid.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)  # first valid index after each run
+
+    # runs touching the end of the recording have no closing sample
+    closed = ends < len(t)
+    starts, ends = starts[closed], ends[closed]
+    durations = t[ends] - t[starts]
+
+    blink = durations > blinkthresh
+    blinks = np.stack([t[starts[blink]], t[ends[blink]]], axis=1)
+
+    fill = ~blink & (starts > 0)
+    if fill.any():
+        lengths = ends[fill] - starts[fill]
+        offsets = starts[fill] - (lengths.cumsum() - lengths)
+        idx = np.repeat(offsets, lengths) + np.arange(lengths.sum())
+        valid = ~invalid
+        x[idx] = np.interp(t[idx], t[valid], x[valid])
+        y[idx] = np.interp(t[idx], t[valid], y[valid])
+
+    return x, y, blinks
@@ -1,9 +1,16 @@
-import tobii_research as tr
+import backend
 import constants
-import os
 import json
 import time
 import math
+import warnings
+
+import numpy as np
+
+from gazebuffer import GazeBuffer, gaze_points
+import gazestats
+from calibstore import CalibrationStore
+from latency import TimeBase
 
 
 from pygaze import libscreen
@@ -13,20 +20,28 @@ from tkinter import messagebox
 
 DEBUG = False
 
+tr = backend.load_backend()
+
 
 class Calibrator(object):
     INVALID = -1
     INVALID_PAIR = (INVALID, INVALID)
 
-    def __init__(self):
-        try:
-            self.eyetracker = tr.find_all_eyetrackers()[0]
-        except IndexError:
-            messagebox.showinfo("Error", "Tobii Eye Tracker not found. Please restart the Tobii Service\nfound in the \"Services\" application")
-            import sys
-            sys.exit(1)
-
-        self.gaze_data = []
+    '''
+    param `eyetracker`: device to calibrate; defaults to the first one found
+    '''
+    def __init__(self, eyetracker=None):
+        if eyetracker is None:
+            try:
+                eyetracker = tr.find_all_eyetrackers()[0]
+            except IndexError:
+                messagebox.showinfo("Error", "Tobii Eye Tracker not found. Please restart the Tobii Service\nfound in the \"Services\" application")
+                import sys
+                sys.exit(1)
+        self.eyetracker = eyetracker
+
+        self.gaze_data = GazeBuffer()
+        self.timebase = TimeBase(tr)
 
         self.disp = libscreen.Display()
         self.screen = libscreen.Screen()
@@ -47,9 +62,9 @@ class Calibrator(object):
         # amount of time gaze has to linger within self.fixtresh to be marked as a fixation
         self.fixtimetresh = 100  # milliseconds
         # saccade velocity threshold
-        self.spdtresh = 35  # degrees per second
+        self.spdtresh = constants.SACCVELTHRESH  # degrees per second
         # saccade acceleration threshold
-        self.accthresh = 9500  # degrees per second**2
+        self.accthresh = constants.SACCACCTHRESH  # degrees per second**2
         # blink detection threshold used in PyGaze method
         self.blinkthresh = 50 # milliseconds
         
@@ -66,6 +81,7 @@ class Calibrator(object):
             'pxfixtresh': self.pxfixtresh,
             'fixtimetresh': self.fixtimetresh,
             'pxdsttresh': self.pxdsttresh,
+            'pxspdtresh': self.pxspdtresh,
             'pxacctresh': self.pxacctresh,
             'blinkthresh': self.blinkthresh
         }
@@ -83,13 +99,14 @@ class Calibrator(object):
             origin = (int(self.disp.dispsize[0] / 4), int(self.disp.dispsize[1] / 4))
             size = (int(2 * self.disp.dispsize[0] / 4), int(2 * self.disp.dispsize[1] / 4))
 
+            seen = 0
             while not self.kb.get_key(keylist=['space'], flush=False)[0]:
-                # TODO: What should we do when there are no gaze samples yet?
-                # Should we wait or raise an Exception to indicate that
-                # something went wrong.
+                # sleep until the tracker delivers a new sample instead of
+                # spinning; the timeout keeps the space key responsive
+                seen = self.gaze_data.wait_for_samples(seen, timeout=0.1)
                 if not self.gaze_data:
                     continue
-                gaze_sample = self.gaze_data[-1]
+                gaze_sample = self.gaze_data.latest()
 
                 self.screen.clear()
 
@@ -262,55 +279,15 @@ class Calibrator(object):
             # # # # # #
             # # validation
 
-            # # # arrays for data storage
-            lxacc, lyacc, rxacc, ryacc = [], [], [], []
-
-            # # loop through all calibration positions
-            for pos in self.points_to_calibrate:
-                # show validation point
-                self.screen.clear()
-                self.screen.draw_fixation(fixtype='dot', pos=pos, colour=(255, 255, 255))
-                self.disp.fill(self.screen)
-                self.disp.show()
-
-                # allow user some time to gaze at dot
-                time.sleep(1)
-
-                lxsamples, lysamples, rxsamples, rysamples = [], [], [], []
-                for sample in self.gaze_data:
-                    if sample["left_gaze_point_validity"]:
-                        gaze_point = self._norm_2_px(sample["left_gaze_point_on_display_area"])
-                        lxsamples.append(abs(gaze_point[0] - pos[0]))
-                        lysamples.append(abs(gaze_point[1] - pos[1]))
-                    if sample["right_gaze_point_validity"]:
-                        gaze_point = self._norm_2_px(sample["right_gaze_point_on_display_area"])
-                        rxsamples.append(abs(gaze_point[0] - pos[0]))
-                        rysamples.append(abs(gaze_point[1] - pos[1]))
-
-                # calculate mean deviation
-                lxacc.append(self._mean(lxsamples))
-                lyacc.append(self._mean(lysamples))
-                rxacc.append(self._mean(rxsamples))
-                ryacc.append(self._mean(rysamples))
-
-                # wait for a bit to slow down validation process a bit
-                time.sleep(1)
-
-            # calculate mean accuracy
-            self.pxaccuracy = [(self._mean(lxacc), self._mean(lyacc)), (self._mean(rxacc), self._mean(ryacc))]
+            intervals = self._validate_points(constants.VALIDATIONSETTLETIME, constants.VALIDATIONSAMPLETIME)
 
             # sample rate
-            # calculate intersample times
-            timestamps = []
-            gaze_samples = self.gaze_data
-            for i in range(0, len(gaze_samples) - 1):
-                next_sample = gaze_samples[i + 1]['system_time_stamp']
-                current_sample = gaze_samples[i]['system_time_stamp']
-                timestamps.append((next_sample - current_sample) / 1000.0)
+            # intersample times within the validation windows
+            self.sampletiming = gazestats.sample_timing(np.concatenate(intervals))
 
             # mean intersample time
-            self.sampletime = self._mean(timestamps)
-            self.samplerate = int(1000.0 / self.sampletime)
+            self.sampletime = self.sampletiming['sampletime']
+            self.samplerate = self.sampletiming['samplerate']
 
             # # # # # #
             # # RMS noise
@@ -334,26 +311,21 @@ class Calibrator(object):
             self.screen.clear()
 
             # # wait for a bit, to allow participant to fixate
-            time.sleep(1)
+            onset = tr.get_system_time_stamp()
+            time.sleep((constants.VALIDATIONSETTLETIME + constants.VALIDATIONSAMPLETIME) / 1000.0)
+            offset = tr.get_system_time_stamp()
 
             # # get samples
-            # samplelist, prefilled with 1 sample to prevent sl[-1] from producing an error
-            # first sample will be ignored for RMS calculation
-            sl = [self.sample()]
-            t0 = self.millis()  # starting time
-            while self.millis() - t0 < 1000:
-                s = self.sample()  # sample
-                if s != sl[-1] and self.is_valid_sample(s) and s != (0, 0):
-                    sl.append(s)
-
-            # # calculate RMS noise
-            Xvar, Yvar = [], []
-            for i in range(2, len(sl)):
-                Xvar.append((sl[i][0] - sl[i - 1][0])**2)
-                Yvar.append((sl[i][1] - sl[i - 1][1])**2)
-            XRMS = (self._mean(Xvar))**0.5
-            YRMS = (self._mean(Yvar))**0.5
-            self.pxdsttresh = (XRMS, YRMS)
+            samples = self.gaze_data.between(onset + constants.VALIDATIONSETTLETIME * 1000, offset)
+            x, y = gaze_points(samples, self.disp.dispsize)
+            valid = np.isfinite(x) & ((x != 0) | (y != 0))
+            x, y = x[valid], y[valid]
+
+            # # calculate RMS noise; None where it could not be measured, so
+            # # the detector falls back to its default instead of zero noise
+            self.pxdsttresh = [None if math.isnan(noise) else noise for noise in gazestats.rms_noise(x, y)]
+            self.pxprecision = [gazestats.precision(samples, 'left', self.disp.dispsize),
+                                gazestats.precision(samples, 'right', self.disp.dispsize)]
 
             # # # # # # #
             # # # calibration report
@@ -363,20 +335,29 @@ class Calibrator(object):
             # in pixels per millisecons
             self.pxspdtresh = self._deg2pix(self.screendist, self.spdtresh / 1000.0, self.pixpercm)
             # in pixels per millisecond**2
-            self.pxacctresh = self._deg2pix(self.screendist, self.accthresh / 1000.0, self.pixpercm)
+            self.pxacctresh = self._deg2pix(self.screendist, self.accthresh / 1000000.0, self.pixpercm)
 
             data_to_write = ''
             data_to_write += "pygaze calibration report start\n"
             data_to_write += "samplerate: %s Hz\n" % self.samplerate
-            data_to_write += "sampletime: %s ms\n" % self.sampletime
+            data_to_write += "sampletime: %s ms (median %s ms, p95 %s ms)\n" % (self.sampletime,
+                                                                              self.sampletiming['median'],
+                                                                              self.sampletiming['p95'])
+            data_to_write += "dropped samples: %s\n" % self.sampletiming['dropped']
             data_to_write += "accuracy (in pixels): LX=%s, LY=%s, RX=%s, RY=%s\n" % (self.pxaccuracy[0][0],
                                                                                      self.pxaccuracy[0][1],
                                                                                      self.pxaccuracy[1][0],
                                                                                      self.pxaccuracy[1][1])
+            data_to_write += "accuracy (in degrees): LX=%s, LY=%s, RX=%s, RY=%s\n" % (self.degaccuracy[0][0],
+                                                                                      self.degaccuracy[0][1],
+                                                                                      self.degaccuracy[1][0],
+                                                                                      self.degaccuracy[1][1])
             data_to_write += "precision (RMS noise in pixels): X=%s, Y=%s\n" % (self.pxdsttresh[0], self.pxdsttresh[1])
+            data_to_write += "precision per eye (RMS noise in pixels): LX=%s, LY=%s, RX=%s, RY=%s\n" % (
+                self.pxprecision[0][0], self.pxprecision[0][1], self.pxprecision[1][0], self.pxprecision[1][1])
             data_to_write += "fixation threshold: %s pixels\n" % self.pxfixtresh
             data_to_write += "speed threshold: %s pixels/ms\n" % self.pxspdtresh
-            data_to_write += "accuracy threshold: %s pixels/ms**2\n" % self.pxacctresh
+            data_to_write += "acceleration threshold: %s pixels/ms**2\n" % self.pxacctresh
             data_to_write += "pygaze calibration report end\n"
 
             self.screen.clear()
@@ -395,9 +376,93 @@ class Calibrator(object):
     def is_valid_sample(self, spos):
         return spos != self.INVALID_PAIR
 
-    def start_recording(self):
-        self.gaze_data = []
-        self.eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self._on_gaze_data, as_dictionary=True)
+    def _validate_points(self, settletime, sampletime):
+        """
+        Show every calibration point in turn and measure the accuracy over
+        `sampletime` ms of samples once the gaze had `settletime` ms to
+        settle. An eye with fewer than VALIDATIONMINSAMPLES valid samples on
+        a target gets NaN there. Sets targetaccuracy (lx, ly, rx, ry per
+        target), pxaccuracy and degaccuracy; returns the intersample
+        intervals seen inside the sample windows.
+        """
+        # # # arrays for data storage
+        lxacc, lyacc, rxacc, ryacc = [], [], [], []
+        self.targetaccuracy = []
+        intervals = []
+        # (target, onset, offset) per validation point, in system_time_stamp microseconds
+        self.validation_windows = []
+
+        # # loop through all calibration positions
+        for pos in self.points_to_calibrate:
+            # show validation point
+            self.screen.clear()
+            self.screen.draw_fixation(fixtype='dot', pos=pos, colour=(255, 255, 255))
+            self.disp.fill(self.screen)
+            self.disp.show()
+            onset = tr.get_system_time_stamp()
+
+            # allow user some time to gaze at dot, then collect the settled window
+            time.sleep((settletime + sampletime) / 1000.0)
+            offset = tr.get_system_time_stamp()
+            self.validation_windows.append((pos, onset, offset))
+
+            samples = self.gaze_data.between(onset + settletime * 1000, offset)
+            lxdev, lydev = self._target_accuracy(samples, 'left', pos)
+            rxdev, rydev = self._target_accuracy(samples, 'right', pos)
+            self.targetaccuracy.append((lxdev, lydev, rxdev, rydev))
+            intervals.append(gazestats.intersample_intervals(samples['system_time_stamp']))
+
+            # calculate mean deviation
+            lxacc.append(lxdev)
+            lyacc.append(lydev)
+            rxacc.append(rxdev)
+            ryacc.append(rydev)
+
+        # calculate mean accuracy over the targets that had gaze; NaN if none did
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.pxaccuracy = [(np.nanmean(lxacc), np.nanmean(lyacc)), (np.nanmean(rxacc), np.nanmean(ryacc))]
+        self.degaccuracy = [tuple(gazestats.pix2deg(self.screendist, eye, self.pixpercm))
+                            for eye in self.pxaccuracy]
+        return intervals
+
+    def _target_accuracy(self, samples, eye, pos):
+        if samples[eye + "_gaze_point_validity"].sum() < constants.VALIDATIONMINSAMPLES:
+            return np.nan, np.nan
+        return gazestats.accuracy(samples, eye, pos, self.disp.dispsize)
+
+    def quick_validate(self, store):
+        """
+        Reapply a cached calibration and run a short validation pass.
+        Returns True if the cached calibration is still accurate enough to
+        skip a full recalibration.
+        """
+        if not store.exists():
+            return False
+
+        self.config = store.load_config()
+        store.apply(self.eyetracker)
+
+        self.start_recording()
+        self.screen.set_background_colour(colour=(0, 0, 0))
+        self._validate_points(constants.QUICKVALIDATIONSETTLETIME, constants.QUICKVALIDATIONSAMPLETIME)
+        self.stop_recording()
+
+        # no gaze on a target (player missing or looking away) proves nothing
+        if any(np.isnan(target).all() for target in self.targetaccuracy):
+            if DEBUG: print("Quick validation: no gaze on some targets")
+            return False
+
+        error = np.nanmax(self.degaccuracy)
+        if DEBUG: print("Quick validation error: {0} degrees".format(error))
+        return error <= constants.MAXCALIBRATIONERROR
+
+    def start_recording(self, as_dictionary=constants.GAZEASDICTIONARY):
+        self.gaze_data.clear()
+        if as_dictionary:
+            self.eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self._on_gaze_data, as_dictionary=True)
+        else:
+            self.eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self._on_gaze_object, as_dictionary=False)
         time.sleep(1)
         self.recording = True
 
@@ -411,6 +476,9 @@ class Calibrator(object):
     def _on_gaze_data(self, gaze_data):
         self.gaze_data.append(gaze_data)
 
+    def _on_gaze_object(self, gaze_data):
+        self.gaze_data.append_object(gaze_data)
+
     def _mean(self, array):
         if array:
             a = [s for s in array if s is not None]
@@ -445,43 +513,53 @@ class Calibrator(object):
     def _px_2_norm(self, pixelized_point):
         return (pixelized_point[0] / self.disp.dispsize[0], pixelized_point[1] / self.disp.dispsize[1])
 
-    def one_eye_gaze_valid(self, eye):
-        return self.gaze_data[-1][eye + "_gaze_point_validity"]
-
-    def one_eye_gaze_sample(self, eye):
-        if self.one_eye_gaze_valid(eye):
-            return self._norm_2_px(self.gaze_data[-1][eye + "_gaze_point_on_display_area"])
+    '''
+    param `gaze_sample`: row of the gaze buffer; defaults to the latest one
+    '''
+    def one_eye_gaze_valid(self, eye, gaze_sample=None):
+        if gaze_sample is None:
+            gaze_sample = self.gaze_data.latest()
+        return gaze_sample[eye + "_gaze_point_validity"]
+
+    def one_eye_gaze_sample(self, eye, gaze_sample=None):
+        if gaze_sample is None:
+            gaze_sample = self.gaze_data.latest()
+        if gaze_sample[eye + "_gaze_point_validity"]:
+            return self._norm_2_px(gaze_sample[eye + "_gaze_point_on_display_area"])
         else:
             return self.INVALID_PAIR
 
     def millis(self):
-        return time.clock() * 1000
+        return self.timebase.now()
 
-    def sample(self):
-        left_sample = self.one_eye_gaze_sample('left')
-        right_sample = self.one_eye_gaze_sample('right')
+    def sample(self, gaze_sample=None):
+        if gaze_sample is None:
+            gaze_sample = self.gaze_data.latest()
+        left_sample = self.one_eye_gaze_sample('left', gaze_sample)
+        right_sample = self.one_eye_gaze_sample('right', gaze_sample)
 
-        if self.one_eye_gaze_valid('left') and self.one_eye_gaze_valid('right'):
+        if self.one_eye_gaze_valid('left', gaze_sample) and self.one_eye_gaze_valid('right', gaze_sample):
             return self._mean([left_sample[0], right_sample[0]]), self._mean([left_sample[1], right_sample[1]])
-        elif self.one_eye_gaze_valid('left'):
+        elif self.one_eye_gaze_valid('left', gaze_sample):
             return left_sample
-        elif self.one_eye_gaze_valid('right'):
+        elif self.one_eye_gaze_valid('right', gaze_sample):
             return right_sample
         else:
             return self.INVALID_PAIR
 
 # Standalone Pygame+Pygaze application invoked by the frontend to calibrate the user
-def calibrate_user(participant_username):
-    calibrator = Calibrator()
-    calibrator.calibrate()
-    
-    basepath = (constants.OUTPUT_PATH, participant_username)
-    calibration_filename = "calibration.json"
+def calibrate_user(participant_username, force=False, eyetracker=None):
+    calibrator = Calibrator(eyetracker)
+    store = CalibrationStore(participant_username, calibrator.eyetracker.serial_number)
 
-    calibration_filepath = os.path.join(*basepath, calibration_filename)
+    # reuse the cached calibration for this user and tracker if it still holds up
+    if not force and calibrator.quick_validate(store):
+        calibrator.cleanup()
+        return True
 
-    if not os.path.exists(os.path.join(*basepath)):
-        os.makedirs(os.path.join(*basepath))
+    if not calibrator.calibrate():
+        calibrator.cleanup()
+        return False
 
-    with open(calibration_filepath, 'w+') as outfile:
-        json.dump(calibrator.config, outfile)
+    store.save(calibrator.config, calibrator.eyetracker.retrieve_calibration_data())
+    return True
@@ -0,0 +1,89 @@
+import constants as c
+
+import os
+import json
+import math
+
+
+def mean(values):
+    # ignores missing values; 0.0 if there are none
+    values = [v for v in values if v is not None]
+    return sum(values) / float(len(values)) if values else 0.0
+
+
+def noise(pxdsttresh):
+    # mean RMS noise of the axes the calibration could measure, or None
+    measured = [n for n in pxdsttresh if n is not None]
+    return mean(measured) if measured else None
+
+
+def pixels_per_cm(dispsize=c.DISPSIZE, screensize=c.SCREENSIZE):
+    return (dispsize[0] / float(screensize[0]) + dispsize[1] / float(screensize[1])) / 2.0
+
+
+def deg2pix(cmdist, angle, pixpercm):
+    return pixpercm * math.tan(math.radians(angle)) * float(cmdist)
+
+
+def with_defaults(config):
+    '''
+    `config` with defaults for the thresholds that calibration files
+    written before pxspdtresh was stored do not have
+    '''
+    pixpercm = pixels_per_cm()
+    defaults = {
+        'pxspdtresh': deg2pix(c.SCREENDIST, c.SACCVELTHRESH / 1000.0, pixpercm),
+        'pxacctresh': deg2pix(c.SCREENDIST, c.SACCACCTHRESH / 1000000.0, pixpercm),
+    }
+    defaults.update(config)
+    return defaults
+
+
+class CalibrationStore(object):
+    '''
+    Per-user, per-tracker calibration cache.
+
+    Keeps the threshold config (`Calibrator.config`) as
+    CALIBRATION_PATH/<user>/<serial>.json and the SDK's raw calibration
+    blob from `retrieve_calibration_data()` next to it as <serial>.bin, so
+    a returning user can skip the interactive calibration.
+    '''
+    def __init__(self, user, serial, path=c.CALIBRATION_PATH):
+        self.directory = os.path.join(path, user)
+        self.config_path = os.path.join(self.directory, serial + '.json')
+        self.data_path = os.path.join(self.directory, serial + '.bin')
+
+    def exists(self):
+        return os.path.exists(self.config_path) and os.path.exists(self.data_path)
+
+    def load_config(self):
+        with open(self.config_path) as infile:
+            return json.load(infile)
+
+    def load_data(self):
+        if not os.path.exists(self.data_path):
+            return None
+        with open(self.data_path, 'rb') as infile:
+            return infile.read()
+
+    def save(self, config, calibration_data=None):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        with open(self.config_path, 'w+') as outfile:
+            json.dump(config, outfile)
+
+        if calibration_data is not None:
+            with open(self.data_path, 'wb') as outfile:
+                outfile.write(calibration_data)
+
+    def apply(self, eyetracker):
+        '''
+        Reapply the stored calibration blob to `eyetracker`; returns False
+        if there is none
+        '''
+        calibration_data = self.load_data()
+        if not calibration_data:
+            return False
+        eyetracker.apply_calibration_data(calibration_data)
+        return True
@@ -70,8 +70,48 @@ JOYTIMEOUT = None # None for no timeout, or a value in milliseconds
 # general
 TRACKERTYPE = 'tobii' # either 'smi', 'eyelink' or 'dummy' (NB: if DUMMYMODE is True, trackertype will be set to dummy automatically)
 SACCVELTHRESH = 35 # degrees per second, saccade velocity threshold
-SACCACCTHRESH = 9500 # degrees per second, saccade acceleration threshold
+SACCACCTHRESH = 9500 # degrees per second**2, saccade acceleration threshold
 TRACKERSERIALNUMBER = 'IS404-100108221063'
+TRACKERSERIALNUMBERS = None # serial numbers of the trackers to use, one per player in player order; None for every connected tracker
+TRACKERBACKEND = 'tobii' # 'tobii' for the Tobii Pro SDK, 'mock' for the offline stand-in in mocktracker.py
+MOCKRECORDING = None # mock only: path of a recorded session (JSON lines of gaze dicts) to replay, None for synthetic gaze
+MOCKSAMPLERATE = 120 # Hz, mock only: sample rate of the synthetic gaze
+MOCKSPEED = 1.0 # mock only: 1 for real time, >1 for accelerated replay, None for as fast as possible
+MOCKTRACKERS = 1 # mock only: number of simulated trackers, each with its own gaze stream
+GAZESAMPLERATE = 600 # Hz, highest sample rate of the trackers we run; sizes the gaze buffer
+GAZEBUFFERWINDOW = 10000 # milliseconds of gaze samples kept in memory
+GAZEASDICTIONARY = False # True to subscribe with the SDK's dictionary form, False for the cheaper object form
+GAZEDECIMATION = 1 # keep every n-th gaze sample in the game (e.g. 10 for ~60 Hz on a 600 Hz tracker)
+FIXATIONTRIGGER = 'dwell' # 'dwell' to steer as soon as a dwell is confirmed, 'end' to wait for the fixation to end
+VELOCITYWINDOW = 15 # milliseconds over which gaze speed is measured, so saccade labels do not depend on the sample rate
+DWELLTIME = 80 # milliseconds the gaze has to stay within the fixation threshold to confirm a dwell
+DWELLALPHA = None # error rate of the sequential dwell test (e.g. 0.01), or None to only use DWELLTIME
+PIPELINEQUEUESIZE = 8 # fixation events buffered for the steering task before the oldest are dropped
+CAPTUREPROCESS = False # True to run gaze capture and fixation detection in their own process (see sharedgaze.py)
+SHAREDEVENTCAPACITY = 1024 # fixation events kept in the shared-memory ring between the capture process and the game
+SHAREDPOLLINTERVAL = 0.001 # seconds between checks of the shared-memory rings for new data
+RECORDSESSION = True # True to record samples, fixations, steering and game events to OUTPUT_PATH/LOGFILE-<time>.session
+RECORDCOMPRESSION = None # 'zlib' to compress session chunks (smaller, slower to load), None to store them raw
+RECORDCHUNKROWS = 4096 # rows per session chunk and stream
+RECORDQUEUESIZE = 64 # full chunks waiting for the session writer before new ones are dropped
+RECORDFLUSHINTERVAL = 5.0 # seconds after which partially filled chunks are written anyway
+HEATMAP = True # True to keep a gaze heatmap per player and save it to OUTPUT_PATH at the end of the session
+HEATMAPBINSIZE = 20 # pixels per heatmap bin along x and y
+HEATMAPPHASES = (6, 12) # snake lengths at which a game enters its mid and late phase; the heatmap is split by phase
+STEERINGMODE = 'head' # 'head' to steer towards the gaze relative to the snake's head, 'zones' for fixed screen zones
+STEERINGHALFLIFE = 500 # milliseconds for a steering vote to lose half its weight
+STEERINGHYSTERESIS = 1.5 # a new direction needs this many times the votes of the current one to turn
+STEERINGDEADZONE = 1 # cells around the head (or the screen centre) where gaze does not steer
+APPLES = 1 # apples on the board at once
+SIMSTEP = 150 # milliseconds per snake move
+MAXSIMSTEPS = 5 # snake moves run at most per frame; after a longer stall the game slows down instead of catching up
+FRAMERATE = 60 # Hz, rate of rendering and of picking up steering commands
+VALIDATIONSETTLETIME = 1000 # milliseconds after a validation target appears before its samples count
+VALIDATIONSAMPLETIME = 1000 # milliseconds of samples used per validation target and for the RMS noise
+QUICKVALIDATIONSETTLETIME = 500 # milliseconds, as VALIDATIONSETTLETIME but when checking a cached calibration
+QUICKVALIDATIONSAMPLETIME = 300 # milliseconds, as VALIDATIONSAMPLETIME but when checking a cached calibration
+VALIDATIONMINSAMPLES = 10 # valid samples an eye needs on a validation target for its accuracy to count
+MAXCALIBRATIONERROR = 1.5 # degrees; worst per-axis accuracy at which a cached calibration is still reused
 # EyeLink only
 # SMI only
 SMIIP = '127.0.0.1'
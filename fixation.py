@@ -0,0 +1,155 @@
+from collections import namedtuple
+import math
+
+import numpy as np
+
+from publisher import Publisher
+
+FIXATION_START = 'fixation_start'
+FIXATION_END = 'fixation_end'
+DWELL = 'dwell'
+
+# stime/etime are sample timestamps in milliseconds; etime is None until the
+# fixation has ended, and for DWELL events it is the time the dwell was
+# confirmed. x, y is the centroid of the fixation in pixels. t is the time the
+# event was emitted, on the detector's clock, or None without one.
+FixationEvent = namedtuple('FixationEvent', ['kind', 'stime', 'etime', 'x', 'y', 't'], defaults=(None,))
+
+# FixationEvents as array rows, for shared memory and session files: kind is
+# the index into EVENT_KINDS, and a missing etime or t is NaN
+EVENT_KINDS = (FIXATION_START, FIXATION_END, DWELL)
+EVENT_DTYPE = np.dtype([
+    ('kind', np.int8),
+    ('stime', np.float64),
+    ('etime', np.float64),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('t', np.float64),
+])
+
+
+def event_row(event):
+    return (EVENT_KINDS.index(event.kind), event.stime, math.nan if event.etime is None else event.etime,
+            event.x, event.y, math.nan if event.t is None else event.t)
+
+
+def event_from_row(kind, stime, etime, x, y, t):
+    return FixationEvent(EVENT_KINDS[kind], stime, None if math.isnan(etime) else etime, x, y,
+                         None if math.isnan(t) else t)
+
+
+class FixationDetector(Publisher):
+    '''
+    Incremental dispersion-threshold (I-DT) fixation detector.
+
+    Feed it one valid gaze sample at a time. It keeps the coordinate sums
+    of the current window, so every sample costs the same no matter how
+    long the window is. `pxfixtresh` is a radius, as the calibration
+    derives it ("maximal distance from fixation start"): a window whose
+    samples all stay within it of the window's running centroid for at
+    least `fixtimetresh` milliseconds is a fixation; the first sample
+    farther out ends it and starts a new window.
+
+    A DWELL event commits to a window before the fixation is over, once per
+    window: after `mindwell` milliseconds inside `pxfixtresh`, or earlier if
+    `dwellalpha` is set and a sequential probability ratio test on the
+    sample-to-sample steps decides the gaze is holding still, though never
+    before half of `mindwell` (the test alone accepts within a few
+    samples, which would commit to every short window). The test pits
+    steps of fixational noise (`noise`, RMS pixels per axis) against steps
+    `noiseratio` times larger, with `dwellalpha` as the error rate. Without
+    a measured `noise` (None) it assumes 1 px.
+
+    `clock` is an optional callable returning the current time in
+    milliseconds, used to stamp events with the time they were emitted.
+    '''
+    def __init__(self, pxfixtresh, fixtimetresh, mindwell=None, dwellalpha=None, noise=1.0, noiseratio=3.0,
+                 clock=None):
+        self.clock = clock
+        self.pxfixtresh = pxfixtresh
+        self.fixtimetresh = fixtimetresh
+        self.mindwell = mindwell
+        self.dwellalpha = dwellalpha
+        if dwellalpha is not None:
+            # Rayleigh log-likelihood ratio of a step s is _llrconst - _llrcoef * s**2
+            still = max(noise if noise is not None else 1.0, 0.5)
+            moving = still * noiseratio
+            self._llrconst = 2 * math.log(moving / still)
+            self._llrcoef = 0.5 * (1.0 / still**2 - 1.0 / moving**2)
+            self._llraccept = math.log((1 - dwellalpha) / dwellalpha)
+        Publisher.__init__(self)
+        self.reset()
+
+    def _emit(self, event):
+        if self.clock is not None:
+            event = event._replace(t=self.clock())
+        Publisher._emit(self, event)
+
+    @property
+    def fixating(self):
+        return self._fixating
+
+    def centroid(self):
+        return self._sumx / self._n, self._sumy / self._n
+
+    def reset(self):
+        self._n = 0
+        self._fixating = False
+
+    def interrupt(self, t):
+        # a blink ends the current fixation at `t`; the next sample starts a new window
+        if self._n and self._fixating:
+            cx, cy = self.centroid()
+            self._emit(FixationEvent(FIXATION_END, self._stime, t, cx, cy))
+        self.reset()
+
+    def _start(self, t, x, y):
+        self._stime = t
+        self._sumx = x
+        self._sumy = y
+        self._n = 1
+        self._fixating = False
+        self._dwelled = False
+        self._llr = 0.0
+        self._lastx, self._lasty = x, y
+
+    def feed(self, t, x, y):
+        if not self._n:
+            self._start(t, x, y)
+            return
+
+        cx, cy = self.centroid()
+        if (x - cx)**2 + (y - cy)**2 > self.pxfixtresh**2:
+            if self._fixating:
+                self._emit(FixationEvent(FIXATION_END, self._stime, t, cx, cy))
+            self._start(t, x, y)
+            return
+
+        self._sumx += x
+        self._sumy += y
+        self._n += 1
+
+        if not self._dwelled and self._dwell(t, x, y):
+            self._dwelled = True
+            cx, cy = self.centroid()
+            self._emit(FixationEvent(DWELL, self._stime, t, cx, cy))
+        self._lastx, self._lasty = x, y
+
+        if not self._fixating and t - self._stime >= self.fixtimetresh:
+            self._fixating = True
+            cx, cy = self.centroid()
+            self._emit(FixationEvent(FIXATION_START, self._stime, None, cx, cy))
+
+    def _dwell(self, t, x, y):
+        if self.mindwell is not None and t - self._stime >= self.mindwell:
+            return True
+        if self.dwellalpha is None:
+            return False
+        step2 = (x - self._lastx)**2 + (y - self._lasty)**2
+        self._llr += self._llrconst - self._llrcoef * step2
+        if self._llr <= -self._llraccept:
+            # evidence says the gaze is moving; restart the test
+            self._llr = 0.0
+        if self.mindwell is not None and t - self._stime < self.mindwell / 2.0:
+            return False
+        return self._llr >= self._llraccept
@@ -0,0 +1,55 @@
+import random
+
+
+class FreeCells(object):
+    '''
+    Indexable set of the free cells of a `cols` x `rows` board with
+    `step`-pixel cells, stored as pixel positions.
+
+    The cells sit in a dense list with a map from cell to list index;
+    removing a cell swaps the last one into its slot. Adding, removing,
+    membership and a uniform random choice are all O(1), however full the
+    board is. Cells off the board are ignored.
+    '''
+    def __init__(self, cols, rows, step):
+        self.cols = cols
+        self.rows = rows
+        self.step = step
+        self.clear()
+
+    def clear(self):
+        # every cell free again
+        self._cells = [(i * self.step, j * self.step) for j in range(self.rows) for i in range(self.cols)]
+        self._index = dict((cell, i) for i, cell in enumerate(self._cells))
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __contains__(self, cell):
+        return cell in self._index
+
+    def on_board(self, cell):
+        x, y = cell
+        return 0 <= x < self.cols * self.step and 0 <= y < self.rows * self.step and \
+            not x % self.step and not y % self.step
+
+    def add(self, cell):
+        if cell in self._index or not self.on_board(cell):
+            return
+        self._index[cell] = len(self._cells)
+        self._cells.append(cell)
+
+    def discard(self, cell):
+        i = self._index.pop(cell, None)
+        if i is None:
+            return
+        last = self._cells.pop()
+        if i < len(self._cells):
+            self._cells[i] = last
+            self._index[last] = i
+
+    def choice(self, rng=random):
+        # uniformly random free cell, or None if the board is full
+        if not self._cells:
+            return None
+        return self._cells[rng.randrange(len(self._cells))]
@@ -0,0 +1,216 @@
+import constants as c
+
+import numpy as np
+import math
+import threading
+
+# One row per gaze sample. Field names match the keys of the Tobii SDK's
+# dictionary form so a row can be indexed exactly like the old dicts.
+GAZE_DTYPE = np.dtype([
+    ('device_time_stamp', np.int64),
+    ('system_time_stamp', np.int64),
+    ('left_gaze_point_on_display_area', np.float32, (2,)),
+    ('left_gaze_point_validity', np.int8),
+    ('left_pupil_diameter', np.float32),
+    ('left_pupil_validity', np.int8),
+    ('left_gaze_origin_in_user_coordinate_system', np.float32, (3,)),
+    ('left_gaze_origin_in_trackbox_coordinate_system', np.float32, (3,)),
+    ('left_gaze_origin_validity', np.int8),
+    ('right_gaze_point_on_display_area', np.float32, (2,)),
+    ('right_gaze_point_validity', np.int8),
+    ('right_pupil_diameter', np.float32),
+    ('right_pupil_validity', np.int8),
+    ('right_gaze_origin_in_user_coordinate_system', np.float32, (3,)),
+    ('right_gaze_origin_in_trackbox_coordinate_system', np.float32, (3,)),
+    ('right_gaze_origin_validity', np.int8),
+])
+
+GAZE_FIELDS = GAZE_DTYPE.names
+
+_NO_ORIGIN = (math.nan, math.nan, math.nan)
+
+
+def gaze_points(samples, dispsize):
+    '''
+    Vectorized counterpart of Tracker.gaze_point(): pixel gaze position per
+    row, the mean of both eyes where both are valid, NaN where neither is.
+    '''
+    left = samples['left_gaze_point_on_display_area'].astype(np.float64)
+    right = samples['right_gaze_point_on_display_area'].astype(np.float64)
+    left[samples['left_gaze_point_validity'] == 0] = np.nan
+    right[samples['right_gaze_point_validity'] == 0] = np.nan
+    points = np.round(np.stack([left, right]) * dispsize)
+    valid = ~np.isnan(points[:, :, 0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        points = np.where(valid[:, :, None], points, 0).sum(axis=0) / valid.sum(axis=0)[:, None]
+    return points[:, 0], points[:, 1]
+
+
+class GazeBuffer(object):
+    '''
+    Fixed-capacity ring buffer of gaze samples.
+
+    Every row is stored twice, at `i` and `i + capacity`, so the newest
+    `capacity` samples are always one contiguous slice and `latest()`,
+    `last()` and `since()` can hand out views instead of copies. Views stay
+    valid until the writer wraps around onto them.
+
+    `decimation` keeps only every n-th incoming sample, for consumers that
+    are happy with ~60 Hz on a high-rate tracker. `origins` controls whether
+    `append_object()` copies the gaze origin fields, which only the
+    calibration positioning screen reads.
+    '''
+    def __init__(self, capacity=None, window=c.GAZEBUFFERWINDOW, samplerate=c.GAZESAMPLERATE,
+                 decimation=1, origins=True):
+        if capacity is None:
+            capacity = int(math.ceil(window * samplerate / float(decimation) / 1000.0))
+        if capacity < 1:
+            raise ValueError('GazeBuffer capacity must be at least 1, got %s' % capacity)
+        if decimation < 1:
+            raise ValueError('GazeBuffer decimation must be at least 1, got %s' % decimation)
+
+        self.capacity = capacity
+        self.decimation = decimation
+        self.origins = origins
+        self._allocate()
+        self._received = 0
+        # guards the rows and counters, and wakes readers blocked in wait_for_samples()
+        self._lock = threading.Condition(threading.Lock())
+
+    def _allocate(self):
+        # storage for the rows and the write count (see sharedgaze.SharedGazeBuffer)
+        self._data = np.zeros(2 * self.capacity, dtype=GAZE_DTYPE)
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    @property
+    def count(self):
+        # total number of samples written since the last clear()
+        return self._count
+
+    def clear(self):
+        with self._lock:
+            self._count = 0
+            self._received = 0
+
+    def _skip(self):
+        self._received += 1
+        return self._received % self.decimation != 0
+
+    def _write(self, row):
+        with self._lock:
+            i = self._count % self.capacity
+            self._data[i] = row
+            self._data[i + self.capacity] = self._data[i]
+            self._count += 1
+            self._lock.notify_all()
+        return True
+
+    def append(self, gaze_sample):
+        '''
+        param `gaze_sample`: gaze data in the SDK's dictionary form
+
+        Returns False if the sample was dropped by decimation.
+        '''
+        if self.decimation > 1 and self._skip():
+            return False
+        return self._write(tuple(gaze_sample[name] for name in GAZE_FIELDS))
+
+    def append_object(self, gaze_data):
+        '''
+        param `gaze_data`: tobii_research.GazeData, as delivered when
+        subscribing with as_dictionary=False
+        '''
+        if self.decimation > 1 and self._skip():
+            return False
+        left, right = gaze_data.left_eye, gaze_data.right_eye
+        lgp, lpu = left.gaze_point, left.pupil
+        rgp, rpu = right.gaze_point, right.pupil
+        if self.origins:
+            lgo, rgo = left.gaze_origin, right.gaze_origin
+            return self._write((gaze_data.device_time_stamp, gaze_data.system_time_stamp,
+                         lgp.position_on_display_area, lgp.validity, lpu.diameter, lpu.validity,
+                         lgo.position_in_user_coordinates, lgo.position_in_track_box_coordinates, lgo.validity,
+                         rgp.position_on_display_area, rgp.validity, rpu.diameter, rpu.validity,
+                         rgo.position_in_user_coordinates, rgo.position_in_track_box_coordinates, rgo.validity))
+        else:
+            return self._write((gaze_data.device_time_stamp, gaze_data.system_time_stamp,
+                         lgp.position_on_display_area, lgp.validity, lpu.diameter, lpu.validity,
+                         _NO_ORIGIN, _NO_ORIGIN, 0,
+                         rgp.position_on_display_area, rgp.validity, rpu.diameter, rpu.validity,
+                         _NO_ORIGIN, _NO_ORIGIN, 0))
+
+    def _window(self, n):
+        # newest n rows as a contiguous view; caller holds the lock
+        n = min(n, self._count, self.capacity)
+        end = (self._count - 1) % self.capacity + self.capacity + 1
+        return self._data[end - n:end]
+
+    def latest(self):
+        with self._lock:
+            if not self._count:
+                raise IndexError('GazeBuffer is empty')
+            return self._data[(self._count - 1) % self.capacity]
+
+    def last(self, n):
+        with self._lock:
+            return self._window(n)
+
+    def window(self):
+        with self._lock:
+            return self._window(self.capacity)
+
+    def since(self, t):
+        '''
+        param `t`: system_time_stamp in microseconds; returns every buffered
+        sample at or after `t`
+        '''
+        with self._lock:
+            rows = self._window(self.capacity)
+        start = np.searchsorted(rows['system_time_stamp'], t, side='left')
+        return rows[start:]
+
+    def between(self, t0, t1):
+        '''
+        Buffered samples with t0 <= system_time_stamp < t1 (microseconds),
+        found by binary search
+        '''
+        with self._lock:
+            rows = self._window(self.capacity)
+        timestamps = rows['system_time_stamp']
+        start, end = np.searchsorted(timestamps, [t0, t1], side='left')
+        return rows[start:end]
+
+    def wait_for_samples(self, since=None, timeout=None):
+        '''
+        Block until the buffer's `count` differs from `since` (default: the
+        current count), or `timeout` seconds have passed. Returns the count,
+        which equals `since` on timeout and is lower after a clear().
+        '''
+        with self._lock:
+            if since is None:
+                since = self._count
+            self._lock.wait_for(lambda: self._count != since, timeout)
+            return self._count
+
+    def samples(self, since=None, timeout=None):
+        '''
+        Yield every new sample exactly once, blocking in between. Stops after
+        `timeout` seconds without a new sample. Samples the writer overwrote
+        before the reader got to them are skipped.
+        '''
+        seen = self._count if since is None else since
+        while True:
+            count = self.wait_for_samples(seen, timeout)
+            if count == seen:
+                return
+            with self._lock:
+                count = self._count
+                if count < seen:
+                    seen = 0
+                rows = self._window(count - seen)
+            seen = count
+            for row in rows:
+                yield row
@@ -0,0 +1,114 @@
+import constants as c
+
+from collections import deque
+import asyncio
+
+from fixation import DWELL, FIXATION_END
+from latency import QUEUE
+
+
+class ChannelClosed(Exception):
+    pass
+
+
+class CoalescingChannel(object):
+    '''
+    Bounded single-loop asyncio channel that never blocks the producer.
+
+    When the channel is full the oldest item is dropped, so a slow consumer
+    always sees the newest data instead of a growing backlog. With
+    `maxsize` 1 it simply holds the latest value.
+    '''
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items = deque()
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_nowait(self, item):
+        if self._closed:
+            return
+        if len(self._items) >= self.maxsize:
+            self._items.popleft()
+            self.dropped += 1
+        self._items.append(item)
+        self._ready.set()
+
+    def get_nowait(self):
+        # oldest item, or None if the channel is empty
+        if not self._items:
+            return None
+        item = self._items.popleft()
+        if not self._items:
+            self._ready.clear()
+        return item
+
+    def drain(self):
+        items = list(self._items)
+        self._items.clear()
+        self._ready.clear()
+        return items
+
+    async def get_all(self):
+        # wait until at least one item is available, then take everything
+        while not self._items:
+            if self._closed:
+                raise ChannelClosed()
+            await self._ready.wait()
+        return self.drain()
+
+    def close(self):
+        self._closed = True
+        self._ready.set()
+
+
+class GazePipeline(object):
+    '''
+    Async streams from the tracker's fixation detector to the game.
+
+    Fixation events of `kind` arrive on the SDK's callback thread and are
+    handed to the event loop with call_soon_threadsafe into the `fixations`
+    channel. The `steer()` task turns each batch into a command with
+    `decide(events)` and publishes it in `commands`, which only keeps the
+    latest command for the game loop to pick up.
+    '''
+    def __init__(self, tracker, kind=None, maxsize=c.PIPELINEQUEUESIZE):
+        if kind is None:
+            kind = DWELL if c.FIXATIONTRIGGER == 'dwell' else FIXATION_END
+        self.tracker = tracker
+        self.kind = kind
+        self.fixations = CoalescingChannel(maxsize)
+        self.commands = CoalescingChannel(1)
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.tracker.fixation_detector.subscribe(self._on_event)
+
+    def stop(self):
+        self.tracker.fixation_detector.unsubscribe(self._on_event)
+        self.fixations.close()
+        self.commands.close()
+
+    def _on_event(self, event):
+        # runs on the SDK's callback thread
+        if event.kind == self.kind:
+            self._loop.call_soon_threadsafe(self.fixations.put_nowait, event)
+
+    async def steer(self, decide):
+        timebase, latency = self.tracker.timebase, self.tracker.latency
+        while True:
+            try:
+                events = await self.fixations.get_all()
+            except ChannelClosed:
+                return
+            taken = timebase.now()
+            for event in events:
+                latency.record(QUEUE, event.t, taken)
+            command = decide(events)
+            if command is not None:
+                self.commands.put_nowait(command)
@@ -0,0 +1,81 @@
+import numpy as np
+
+# an interval longer than this many nominal sample times counts as a gap
+DROP_FACTOR = 1.5
+
+
+def pix2deg(cmdist, pixels, pixpercm):
+    # inverse of the trackers' _deg2pix
+    return np.degrees(np.arctan(np.asarray(pixels) / pixpercm / float(cmdist)))
+
+
+def eye_points(samples, eye, dispsize):
+    '''
+    Pixel gaze points of one eye over gaze buffer rows, valid rows only
+    '''
+    valid = samples[eye + "_gaze_point_validity"].astype(bool)
+    return np.round(samples[eye + "_gaze_point_on_display_area"][valid] * dispsize)
+
+
+def intersample_intervals(timestamps):
+    '''
+    param `timestamps`: system_time_stamp column in microseconds; returns
+    the intervals in milliseconds
+    '''
+    return np.diff(np.asarray(timestamps, dtype=np.int64)) / 1000.0
+
+
+def sample_timing(intervals):
+    '''
+    param `intervals`: intersample intervals in milliseconds
+
+    The median interval is taken as the nominal sample time. Every interval
+    longer than DROP_FACTOR times that adds the number of samples that would
+    have fit in it to `dropped`.
+    '''
+    intervals = np.asarray(intervals, dtype=np.float64)
+    if not len(intervals):
+        return {'sampletime': 0, 'samplerate': 0, 'median': 0, 'p95': 0, 'dropped': 0}
+    mean = intervals.mean()
+    median, p95 = np.percentile(intervals, [50, 95])
+    gaps = intervals[intervals > DROP_FACTOR * median]
+    dropped = int(np.rint(gaps / median).sum() - len(gaps)) if median > 0 else 0
+    return {
+        'sampletime': mean,
+        'samplerate': int(1000.0 / mean) if mean > 0 else 0,
+        'median': median,
+        'p95': p95,
+        'dropped': dropped,
+    }
+
+
+def rms_noise(x, y):
+    '''
+    Sample-to-sample RMS noise along x and y, in the units of x and y, or
+    NaN for fewer than two points
+    '''
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if len(x) < 2:
+        return np.nan, np.nan
+    return (np.diff(x)**2).mean()**0.5, (np.diff(y)**2).mean()**0.5
+
+
+def accuracy(samples, eye, pos, dispsize):
+    '''
+    Mean absolute x and y distance in pixels between `pos` and the valid
+    gaze points of one eye, or NaN if there are none
+    '''
+    points = eye_points(samples, eye, dispsize)
+    if not len(points):
+        return np.nan, np.nan
+    xdev, ydev = np.abs(points - pos).mean(axis=0)
+    return xdev, ydev
+
+
+def precision(samples, eye, dispsize):
+    '''
+    Sample-to-sample RMS noise in pixels of one eye, NaN without two valid
+    points
+    '''
+    points = eye_points(samples, eye, dispsize)
+    return rms_noise(points[:, 0], points[:, 1])
@@ -0,0 +1,175 @@
+import constants as c
+
+from collections import OrderedDict
+import argparse
+import bisect
+import math
+import os
+import time
+
+import numpy as np
+
+from gazebuffer import gaze_points
+
+# game phases, by snake length (see HEATMAPPHASES)
+EARLY = 'early'
+MID = 'mid'
+LATE = 'late'
+PHASES = (EARLY, MID, LATE)
+HEAD = 'head'
+
+
+def phase(length, bounds=c.HEATMAPPHASES):
+    return PHASES[bisect.bisect_right(bounds, length)]
+
+
+def heatmap_path(player=0):
+    # next to the session file of the same run
+    return os.path.join(c.OUTPUT_PATH, '%s-%s-heatmap-%d.npz' % (c.LOGFILE, time.strftime('%Y%m%d-%H%M%S'), player))
+
+
+class Heatmap(object):
+    '''
+    2D histogram of gaze positions, built up incrementally.
+
+    It covers `size` pixels from `origin` in square bins of `binsize`
+    pixels, so its memory depends only on the grid. `add()` bins a whole
+    batch of points at once; points off the grid are only counted in
+    `outside`, untracked (NaN) ones not at all.
+    '''
+    def __init__(self, size=c.DISPSIZE, binsize=c.HEATMAPBINSIZE, origin=(0, 0)):
+        self.size = tuple(size)
+        self.binsize = binsize
+        self.origin = tuple(origin)
+        self.shape = (int(math.ceil(size[1] / float(binsize))), int(math.ceil(size[0] / float(binsize))))
+        self.counts = np.zeros(self.shape, dtype=np.int64)
+        self.outside = 0
+
+    def __len__(self):
+        # number of points binned
+        return int(self.counts.sum())
+
+    def add(self, x, y):
+        '''
+        param `x`, `y`: arrays of gaze positions in pixels
+        '''
+        col = np.floor((np.asarray(x, dtype=np.float64) - self.origin[0]) / self.binsize)
+        row = np.floor((np.asarray(y, dtype=np.float64) - self.origin[1]) / self.binsize)
+        tracked = np.isfinite(col) & np.isfinite(row)
+        col, row = col[tracked], row[tracked]
+        inside = (col >= 0) & (col < self.shape[1]) & (row >= 0) & (row < self.shape[0])
+        self.outside += int(len(col) - inside.sum())
+        cells = row[inside].astype(np.intp) * self.shape[1] + col[inside].astype(np.intp)
+        self.counts += np.bincount(cells, minlength=self.counts.size).reshape(self.shape)
+
+    def merge(self, other):
+        if (other.size, other.binsize, other.origin) != (self.size, self.binsize, self.origin):
+            raise ValueError('cannot merge a %s heatmap with %s px bins from %s into a %s one with %s px bins from %s'
+                             % (other.size, other.binsize, other.origin, self.size, self.binsize, self.origin))
+        self.counts += other.counts
+        self.outside += other.outside
+        return self
+
+    def image(self):
+        '''
+        The counts as an RGB array of the grid's shape, black to red to
+        yellow to white on a square-root scale
+        '''
+        peak = self.counts.max()
+        level = np.sqrt(self.counts / float(peak)) if peak else np.zeros(self.shape)
+        rgb = np.clip(np.stack([3 * level, 3 * level - 1, 3 * level - 2], axis=-1), 0, 1)
+        return (rgb * 255).astype(np.uint8)
+
+    def save_image(self, path):
+        # one block of binsize pixels per bin
+        import pygame
+        surface = pygame.surfarray.make_surface(self.image().swapaxes(0, 1))
+        surface = pygame.transform.scale(surface, (self.shape[1] * self.binsize, self.shape[0] * self.binsize))
+        pygame.image.save(surface, path)
+
+
+class GazeHeatmaps(object):
+    '''
+    Where one player looked during a session: a board heatmap per game
+    phase, and a HEAD heatmap of the gaze relative to the snake's head,
+    which spans twice the display so every offset fits.
+
+    Call `update()` once per frame. It takes the samples the tracker wrote
+    to its gaze buffer since the previous call (at most the buffer's
+    capacity) and bins them in one go, so the cost per frame is a few
+    vectorized passes and memory does not grow with the session.
+    '''
+    def __init__(self, binsize=c.HEATMAPBINSIZE, dispsize=c.DISPSIZE):
+        self.dispsize = tuple(dispsize)
+        self.maps = OrderedDict((name, Heatmap(dispsize, binsize)) for name in PHASES)
+        self.maps[HEAD] = Heatmap((2 * dispsize[0], 2 * dispsize[1]), binsize, (-dispsize[0], -dispsize[1]))
+        self._seen = 0
+
+    def __getitem__(self, name):
+        return self.maps[name]
+
+    def update(self, gaze_data, phase, head):
+        '''
+        param `gaze_data`: the tracker's GazeBuffer
+        param `phase`: game phase the new samples count towards, see phase()
+        param `head`: centre of the snake's head in pixels
+        '''
+        count = gaze_data.count
+        if count < self._seen:
+            # the buffer was cleared
+            self._seen = 0
+        if count == self._seen:
+            return
+        rows = gaze_data.last(count - self._seen)
+        self._seen = count
+        x, y = gaze_points(rows, self.dispsize)
+        self.maps[phase].add(x, y)
+        self.maps[HEAD].add(x - head[0], y - head[1])
+
+    def merge(self, other):
+        for name, heatmap in self.maps.items():
+            heatmap.merge(other.maps[name])
+        return self
+
+    def save(self, path, images=True):
+        '''
+        Write the counts of every heatmap to the .npz file `path` and, with
+        `images`, a PNG per heatmap next to it
+        '''
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        arrays = dict((name, heatmap.counts) for name, heatmap in self.maps.items())
+        arrays['outside'] = np.array([heatmap.outside for heatmap in self.maps.values()])
+        arrays['binsize'] = np.array(self.maps[EARLY].binsize)
+        arrays['dispsize'] = np.array(self.dispsize)
+        np.savez_compressed(path, **arrays)
+        if images:
+            for name, heatmap in self.maps.items():
+                heatmap.save_image('%s-%s.png' % (os.path.splitext(path)[0], name))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            heatmaps = cls(int(arrays['binsize']), tuple(int(n) for n in arrays['dispsize']))
+            for (name, heatmap), outside in zip(heatmaps.maps.items(), arrays['outside']):
+                heatmap.counts[:] = arrays[name]
+                heatmap.outside = int(outside)
+        return heatmaps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Merge gaze heatmaps saved by several sessions.')
+    parser.add_argument('output', help='merged heatmap file (.npz); a PNG per heatmap is written next to it')
+    parser.add_argument('heatmaps', nargs='+', help='heatmap files saved at the end of sessions')
+    args = parser.parse_args(argv)
+
+    merged = GazeHeatmaps.load(args.heatmaps[0])
+    for path in args.heatmaps[1:]:
+        merged.merge(GazeHeatmaps.load(path))
+    merged.save(args.output)
+    print('%d heatmaps merged into %s' % (len(args.heatmaps), args.output))
+
+
+if __name__ == '__main__':
+    main()
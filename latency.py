@@ -0,0 +1,109 @@
+import math
+import threading
+
+# histogram range and resolution, in milliseconds
+HISTOGRAM_MIN = 0.01
+HISTOGRAM_MAX = 100000.0
+BINS_PER_DECADE = 20
+
+# pipeline stages; each histogram holds the delay from the previous stage
+TRACKER = 'tracker'  # sample timestamp -> sample received in the gaze callback
+DETECTOR = 'detector'  # sample received -> fixation/dwell event emitted
+QUEUE = 'queue'  # event emitted -> event taken by the game
+APPLY = 'apply'  # event taken -> direction applied by the game update
+FRAME = 'frame'  # direction applied -> frame flipped
+TOTAL = 'total'  # timestamp of the sample that committed the event -> frame flipped
+
+
+class TimeBase(object):
+    '''
+    Monotonic millisecond clock on the tracker's system_time_stamp timeline.
+
+    The SDK stamps every sample with its own system clock, so using that
+    same clock for local events lets sample timestamps and event times be
+    subtracted directly.
+
+    param `tr`: tracker backend module (see backend.load_backend())
+    '''
+    def __init__(self, tr):
+        self._system_time_stamp = tr.get_system_time_stamp
+
+    def now(self):
+        return self._system_time_stamp() / 1000.0
+
+    @staticmethod
+    def sample_time(system_time_stamp):
+        return system_time_stamp / 1000.0
+
+
+class Histogram(object):
+    '''
+    Fixed log-binned histogram of delays in milliseconds; O(1) per record,
+    percentiles accurate to one bin (~12%).
+    '''
+    def __init__(self):
+        self._decades = math.log10(HISTOGRAM_MAX / HISTOGRAM_MIN)
+        self.counts = [0] * (int(self._decades * BINS_PER_DECADE) + 2)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, delay):
+        if delay < HISTOGRAM_MIN:
+            i = 0
+        elif delay >= HISTOGRAM_MAX:
+            i = len(self.counts) - 1
+        else:
+            i = int(math.log10(delay / HISTOGRAM_MIN) * BINS_PER_DECADE) + 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total += delay
+        if delay > self.max:
+            self.max = delay
+
+    def percentile(self, q):
+        # upper edge of the bin holding the q-th percentile
+        if not self.n:
+            return None
+        rank = q / 100.0 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(HISTOGRAM_MIN * 10 ** (i / float(BINS_PER_DECADE)), self.max)
+        return self.max
+
+    def summary(self):
+        if not self.n:
+            return {'n': 0}
+        return {
+            'n': self.n,
+            'mean': self.total / self.n,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class LatencyTrace(object):
+    '''
+    Named stage-to-stage delay histograms (TRACKER ... TOTAL above),
+    queryable while the game runs.
+    '''
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, start, end):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, Histogram())
+        histogram.record(end - start)
+
+    def histogram(self, stage):
+        return self._histograms.get(stage)
+
+    def summary(self):
+        return dict((stage, histogram.summary()) for stage, histogram in list(self._histograms.items()))
@@ -0,0 +1,299 @@
+import constants as c
+
+from collections import namedtuple
+import json
+import math
+import random
+import threading
+import time
+
+# Offline stand-in for the parts of tobii_research this project uses. Select
+# it with TRACKERBACKEND = 'mock'; see backend.py.
+
+EYETRACKER_GAZE_DATA = 'gaze_data'
+
+CALIBRATION_STATUS_SUCCESS = 'calibration_status_success'
+CALIBRATION_STATUS_FAILURE = 'calibration_status_failure'
+
+VALIDITY_INVALID = 0
+VALIDITY_VALID = 1
+VALIDITY_VALID_AND_USED = 'validity_valid_and_used'
+
+# object form of a gaze sample, with the attribute names of tobii_research.GazeData
+GazePoint = namedtuple('GazePoint', ['position_on_display_area', 'position_in_user_coordinates', 'validity'])
+PupilData = namedtuple('PupilData', ['diameter', 'validity'])
+GazeOrigin = namedtuple('GazeOrigin', ['position_in_user_coordinates', 'position_in_track_box_coordinates',
+                                       'validity'])
+EyeData = namedtuple('EyeData', ['gaze_point', 'pupil', 'gaze_origin'])
+GazeData = namedtuple('GazeData', ['left_eye', 'right_eye', 'device_time_stamp', 'system_time_stamp'])
+
+CalibrationEyeData = namedtuple('CalibrationEyeData', ['position_on_display_area', 'validity'])
+CalibrationSample = namedtuple('CalibrationSample', ['left_eye', 'right_eye'])
+CalibrationPoint = namedtuple('CalibrationPoint', ['position_on_display_area', 'calibration_samples'])
+CalibrationResult = namedtuple('CalibrationResult', ['status', 'calibration_points'])
+
+
+class ReplayClock(object):
+    '''
+    Microsecond clock shared by every mock tracker and get_system_time_stamp().
+
+    At `speed` 1 it follows the wall clock, at higher speeds it runs that
+    many times faster, and with `speed` None (as fast as possible) it only
+    advances when a sample is delivered.
+    '''
+    def __init__(self):
+        self.speed = 1.0
+        self._wall0 = time.monotonic()
+        self._t0 = 0
+        self._now = 0
+
+    def start(self, speed):
+        self._t0 = self.now()
+        self._wall0 = time.monotonic()
+        self._now = self._t0
+        self.speed = speed
+
+    def now(self):
+        if self.speed is None:
+            return self._now
+        return self._t0 + int((time.monotonic() - self._wall0) * 1e6 * self.speed)
+
+    def wait_until(self, t):
+        if self.speed is None:
+            self._now = max(self._now, t)
+            return
+        delay = (t - self.now()) / 1e6 / self.speed
+        if delay > 0:
+            time.sleep(delay)
+
+
+clock = ReplayClock()
+
+
+def get_system_time_stamp():
+    return clock.now()
+
+
+def _eye_sample(x, y, valid, pupil):
+    validity = VALIDITY_VALID if valid else VALIDITY_INVALID
+    point = (x, y) if valid else (math.nan, math.nan)
+    return {
+        'gaze_point_on_display_area': point,
+        'gaze_point_in_user_coordinate_system': (math.nan, math.nan, math.nan),
+        'gaze_point_validity': validity,
+        'pupil_diameter': pupil if valid else math.nan,
+        'pupil_validity': validity,
+        'gaze_origin_in_user_coordinate_system': (0.0, 0.0, 600.0),
+        'gaze_origin_in_trackbox_coordinate_system': (0.5, 0.5, 0.5),
+        'gaze_origin_validity': validity,
+    }
+
+
+def gaze_sample(t, x, y, valid=True, pupil=3.0):
+    '''
+    Gaze data dict in the SDK's dictionary form, both eyes at (x, y) in
+    normalized display coordinates, at `t` microseconds
+    '''
+    sample = {'device_time_stamp': t, 'system_time_stamp': t}
+    for eye in ('left', 'right'):
+        for key, value in _eye_sample(x, y, valid, pupil).items():
+            sample[eye + '_' + key] = value
+    return sample
+
+
+def to_object(sample):
+    eyes = []
+    for eye in ('left', 'right'):
+        eyes.append(EyeData(
+            GazePoint(sample[eye + '_gaze_point_on_display_area'],
+                      sample[eye + '_gaze_point_in_user_coordinate_system'],
+                      sample[eye + '_gaze_point_validity']),
+            PupilData(sample[eye + '_pupil_diameter'], sample[eye + '_pupil_validity']),
+            GazeOrigin(sample[eye + '_gaze_origin_in_user_coordinate_system'],
+                       sample[eye + '_gaze_origin_in_trackbox_coordinate_system'],
+                       sample[eye + '_gaze_origin_validity'])))
+    return GazeData(eyes[0], eyes[1], sample['device_time_stamp'], sample['system_time_stamp'])
+
+
+class SyntheticGaze(object):
+    '''
+    Endless deterministic stream of gaze dicts: fixations at random (or
+    `look_at()`) targets with Gaussian noise, linear saccades between them,
+    blinks and single-sample dropouts. Timestamps start at 0 microseconds.
+
+    `fixation` and `saccade` are (min, max) durations in milliseconds,
+    `noise` is the per-axis standard deviation in normalized coordinates and
+    `blinkrate`/`droprate` are probabilities per fixation and per sample.
+    '''
+    def __init__(self, samplerate=120, seed=None, fixation=(200, 600), saccade=(20, 60), noise=0.002,
+                 blinkrate=0.1, blinkduration=(100, 300), droprate=0.005):
+        self.samplerate = samplerate
+        self.fixation = fixation
+        self.saccade = saccade
+        self.noise = noise
+        self.blinkrate = blinkrate
+        self.blinkduration = blinkduration
+        self.droprate = droprate
+        self._random = random.Random(seed)
+        self._targets = []
+
+    def look_at(self, x, y):
+        # make the next fixation land on (x, y)
+        self._targets.append((x, y))
+
+    def _next_target(self):
+        if self._targets:
+            return self._targets.pop(0)
+        return self._random.uniform(0.05, 0.95), self._random.uniform(0.05, 0.95)
+
+    def __iter__(self):
+        rnd = self._random
+        step = 1e6 / self.samplerate
+        t = 0.0
+        x, y = self._next_target()
+        while True:
+            # fixation, possibly interrupted by a blink
+            duration = rnd.uniform(*self.fixation) * 1000
+            blink = None
+            if rnd.random() < self.blinkrate:
+                start = rnd.uniform(0, duration)
+                blink = (t + start, t + start + rnd.uniform(*self.blinkduration) * 1000)
+                duration = max(duration, blink[1] - t)
+            end = t + duration
+            while t < end:
+                valid = not (blink and blink[0] <= t < blink[1]) and rnd.random() >= self.droprate
+                yield gaze_sample(int(t), x + rnd.gauss(0, self.noise), y + rnd.gauss(0, self.noise), valid)
+                t += step
+
+            # saccade to the next target
+            nx, ny = self._next_target()
+            duration = rnd.uniform(*self.saccade) * 1000
+            start = t
+            while t < start + duration:
+                f = (t - start) / duration
+                yield gaze_sample(int(t), x + f * (nx - x), y + f * (ny - y))
+                t += step
+            x, y = nx, ny
+
+
+class RecordedGaze(object):
+    '''
+    Gaze dicts read back from a file with one JSON object per line in the
+    SDK's dictionary form. Timestamps are shifted to start at 0.
+    '''
+    def __init__(self, path, loop=False):
+        self.path = path
+        self.loop = loop
+
+    def __iter__(self):
+        while True:
+            t0 = None
+            offset = 0
+            with open(self.path) as infile:
+                for line in infile:
+                    sample = json.loads(line)
+                    if t0 is None:
+                        t0 = sample['system_time_stamp']
+                    offset = sample['system_time_stamp'] - t0
+                    sample['device_time_stamp'] = offset
+                    sample['system_time_stamp'] = offset
+                    yield sample
+            if not self.loop or t0 is None:
+                return
+
+
+class MockEyeTracker(object):
+    '''
+    Stand-in for tobii_research.EyeTracker that replays `source` (an
+    iterable of gaze dicts with timestamps from 0) to gaze data subscribers.
+
+    `speed` is 1 for real time, > 1 for accelerated replay and None for as
+    fast as possible; it drives the module clock behind
+    get_system_time_stamp().
+    '''
+    def __init__(self, source=None, speed=1.0, serial_number='MOCK-0001'):
+        self.source = source if source is not None else SyntheticGaze()
+        self.speed = speed
+        self.serial_number = serial_number
+        self.model = 'Mock'
+        self.address = 'mock://' + serial_number
+        self.calibration_data = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe_to(self, stream, callback, as_dictionary=False):
+        if stream != EYETRACKER_GAZE_DATA:
+            raise ValueError('MockEyeTracker only provides %s, not %s' % (EYETRACKER_GAZE_DATA, stream))
+        self.unsubscribe_from(stream)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._replay, args=(callback, as_dictionary), daemon=True)
+        self._thread.start()
+
+    def unsubscribe_from(self, stream, callback=None):
+        if self._thread is not None:
+            self._stop.set()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+
+    def _replay(self, callback, as_dictionary):
+        clock.start(self.speed)
+        t0 = clock.now()
+        for sample in self.source:
+            if self._stop.is_set():
+                return
+            t = t0 + sample['system_time_stamp']
+            clock.wait_until(t)
+            sample['system_time_stamp'] = t
+            sample['device_time_stamp'] = t
+            callback(sample if as_dictionary else to_object(sample))
+
+    def retrieve_calibration_data(self):
+        return self.calibration_data or b'mock calibration'
+
+    def apply_calibration_data(self, calibration_data):
+        self.calibration_data = calibration_data
+
+
+class ScreenBasedCalibration(object):
+    '''
+    Stand-in for tobii_research.ScreenBasedCalibration; every point succeeds.
+    With a SyntheticGaze source the simulated eye looks at each point.
+    '''
+    def __init__(self, eyetracker):
+        self.eyetracker = eyetracker
+        self._points = []
+
+    def enter_calibration_mode(self):
+        self._points = []
+
+    def leave_calibration_mode(self):
+        pass
+
+    def collect_data(self, x, y):
+        if hasattr(self.eyetracker.source, 'look_at'):
+            self.eyetracker.source.look_at(x, y)
+        self._points.append((x, y))
+        return CALIBRATION_STATUS_SUCCESS
+
+    def discard_data(self, x, y):
+        self._points = [p for p in self._points if p != (x, y)]
+
+    def compute_and_apply(self):
+        points = []
+        for x, y in self._points:
+            eye = CalibrationEyeData((x, y), VALIDITY_VALID_AND_USED)
+            points.append(CalibrationPoint((x, y), [CalibrationSample(eye, eye)]))
+        self.eyetracker.calibration_data = json.dumps(self._points).encode()
+        return CalibrationResult(CALIBRATION_STATUS_SUCCESS, points)
+
+
+def find_all_eyetrackers():
+    eyetrackers = []
+    for i in range(c.MOCKTRACKERS):
+        if c.MOCKRECORDING:
+            source = RecordedGaze(c.MOCKRECORDING, loop=True)
+        else:
+            source = SyntheticGaze(samplerate=c.MOCKSAMPLERATE)
+        eyetrackers.append(MockEyeTracker(source, speed=c.MOCKSPEED, serial_number='MOCK-%04d' % (i + 1)))
+    return eyetrackers
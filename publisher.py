@@ -0,0 +1,20 @@
+class Publisher(object):
+    '''
+    Subscriber list for event sources such as FixationDetector and
+    GapFiller.
+
+    The list is copied on write, so events can be emitted on the gaze
+    callback thread while another thread subscribes, without a lock.
+    '''
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        self._subscribers = [s for s in self._subscribers if s is not callback]
+
+    def _emit(self, event):
+        for callback in self._subscribers:
+            callback(event)
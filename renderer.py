@@ -0,0 +1,63 @@
+import pygame
+
+# fraction of the board's cells dirty in one frame above which the whole
+# frame is redrawn and flipped instead
+FULL_REDRAW = 0.25
+
+
+class DirtyRenderer(object):
+    '''
+    Cell-based dirty-rectangle renderer for a board of `cellsize` cells.
+
+    The background is drawn once into a cached surface. Each frame only the
+    cells passed to `render()` are restored from it and their sprites
+    redrawn with a single `Surface.blits` call, and only those rectangles
+    are pushed with `pygame.display.update(rects)`. After `invalidate()` (or
+    when too many cells are dirty) the frame is redrawn in full and flipped.
+    Sprites are cropped to their cell so none spills into a neighbour.
+
+    param `color`: background fill
+    '''
+    def __init__(self, surface, cellsize, color=(0, 0, 0)):
+        self.surface = surface
+        self.cellsize = cellsize
+        self.bounds = surface.get_rect()
+        self.area = pygame.Rect(0, 0, cellsize, cellsize)
+        self.background = pygame.Surface(self.bounds.size).convert()
+        self.background.fill(color)
+        self._maxdirty = FULL_REDRAW * (self.bounds.width // cellsize) * (self.bounds.height // cellsize)
+        self.invalidate()
+
+    def invalidate(self):
+        # redraw everything on the next frame
+        self._full = True
+
+    def render(self, dirty, sprite, sprites):
+        '''
+        param `dirty`: cells (pixel positions) that changed since the last frame
+        param `sprite`: callable giving the image to draw in a cell, or None
+        param `sprites`: callable giving every (image, cell) on the board, for full redraws
+        '''
+        if self._full or len(dirty) > self._maxdirty:
+            self.surface.blit(self.background, (0, 0))
+            self.surface.blits([(image, cell, self.area) for image, cell in sprites()], doreturn=False)
+            pygame.display.flip()
+            self._full = False
+            return
+
+        rects = []
+        blits = []
+        images = []
+        size = (self.cellsize, self.cellsize)
+        for cell in set(dirty):
+            rect = pygame.Rect(cell, size)
+            if not self.bounds.colliderect(rect):
+                continue
+            rects.append(rect)
+            blits.append((self.background, rect, rect))
+            image = sprite(cell)
+            if image is not None:
+                images.append((image, cell, self.area))
+        if rects:
+            self.surface.blits(blits + images, doreturn=False)
+            pygame.display.update(rects)
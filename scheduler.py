@@ -0,0 +1,85 @@
+import constants as c
+
+import time
+
+from latency import Histogram
+
+
+def _millis():
+    return time.monotonic() * 1000.0
+
+
+class FixedTimestep(object):
+    '''
+    Fixed-timestep simulation clock with an accumulator.
+
+    Call `advance()` once per rendered frame. It adds the time since the
+    previous frame to the accumulator and returns how many `step`
+    millisecond simulation ticks are due, so the simulation runs at the
+    same speed whatever the frame rate. At most `maxsteps` ticks run per
+    frame; time beyond that is dropped (and counted) so a stall slows the
+    game down instead of making it catch up in a burst.
+
+    Frame intervals and the work done per frame (`advance()` to
+    `frame_done()`) are kept in histograms, see `stats()`.
+
+    param `clock`: callable returning the current time in milliseconds,
+    the monotonic wall clock by default
+    '''
+    def __init__(self, step=c.SIMSTEP, maxsteps=c.MAXSIMSTEPS, clock=None):
+        self.step = step
+        self.maxsteps = maxsteps
+        self.clock = clock if clock is not None else _millis
+        self.reset()
+
+    def reset(self):
+        self._last = None
+        self._accumulator = 0.0
+        self.frames = 0
+        self.ticks = 0
+        self.dropped = 0
+        self.intervals = Histogram()
+        self.work = Histogram()
+
+    @property
+    def alpha(self):
+        # fraction of a step since the last tick, for interpolating between ticks
+        return self._accumulator / self.step
+
+    def advance(self, now=None):
+        now = self.clock() if now is None else now
+        if self._last is not None:
+            elapsed = now - self._last
+            self.intervals.record(elapsed)
+            self._accumulator += elapsed
+        self._last = now
+        self.frames += 1
+
+        steps = int(self._accumulator // self.step)
+        if steps > self.maxsteps:
+            self.dropped += steps - self.maxsteps
+            self._accumulator -= (steps - self.maxsteps) * self.step
+            steps = self.maxsteps
+        self._accumulator -= steps * self.step
+        self.ticks += steps
+        return steps
+
+    def frame_done(self, now=None):
+        now = self.clock() if now is None else now
+        if self._last is not None:
+            self.work.record(now - self._last)
+
+    def next_tick(self):
+        # clock time at which the next tick is due
+        if self._last is None:
+            return self.clock()
+        return self._last + self.step - self._accumulator
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'ticks': self.ticks,
+            'dropped': self.dropped,
+            'interval_ms': self.intervals.summary(),
+            'work_ms': self.work.summary(),
+        }
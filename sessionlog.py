@@ -0,0 +1,284 @@
+import constants as c
+
+from collections import OrderedDict
+import functools
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from gazebuffer import GAZE_DTYPE
+from fixation import EVENT_DTYPE, event_row
+
+# Session file: a header, then chunks appended as they fill up.
+#
+#   header  MAGIC, uint32 length, JSON schema {"streams": {name: {"id", "fields"}}, ...}
+#   chunk   CHUNK_HEADER (magic, stream id, player, codec, rows, payload bytes),
+#           then the payload: the chunk's columns back to back, each `rows`
+#           values of one field, zlib-compressed as a whole if codec is ZLIB
+#
+# A chunk holds one stream of one player. Chunks are only ever appended, so
+# a session cut short by a crash loads up to its last complete chunk.
+
+MAGIC = b'GZSESS01'
+CHUNK_MAGIC = b'CHNK'
+CHUNK_HEADER = struct.Struct('<4sBBBxIQ')
+
+RAW = 0
+ZLIB = 1
+CODECS = {None: RAW, 'zlib': ZLIB}
+
+SAMPLES = 'samples'  # gaze samples, GAZE_DTYPE
+EVENTS = 'events'  # fixation/dwell events, EVENT_DTYPE
+COMMANDS = 'commands'  # steering commands with the event that decided them
+GAME = 'game'  # game events, kind from GAME_KINDS
+
+GAME_KINDS = ('new_game', 'spawn', 'eat', 'crash')
+
+COMMAND_DTYPE = np.dtype([
+    ('t', np.float64),
+    ('direction', np.int8),
+    ('stime', np.float64),
+    ('etime', np.float64),
+    ('x', np.float64),
+    ('y', np.float64),
+])
+GAME_DTYPE = np.dtype([
+    ('t', np.float64),
+    ('kind', np.int8),
+    ('x', np.int32),
+    ('y', np.int32),
+    ('length', np.int32),
+])
+
+STREAMS = OrderedDict([(SAMPLES, GAZE_DTYPE), (EVENTS, EVENT_DTYPE), (COMMANDS, COMMAND_DTYPE), (GAME, GAME_DTYPE)])
+
+
+def session_path():
+    # a new file per session, named after LOGFILE
+    return os.path.join(c.OUTPUT_PATH, '%s-%s.session' % (c.LOGFILE, time.strftime('%Y%m%d-%H%M%S')))
+
+
+def _fields(dtype):
+    return [[name, dtype[name].base.str, list(dtype[name].shape)] for name in dtype.names]
+
+
+def _dtype(fields):
+    return np.dtype([(name, base, tuple(shape)) for name, base, shape in fields])
+
+
+def _millis():
+    return time.monotonic() * 1000.0
+
+
+class SessionRecorder(object):
+    '''
+    Streams a session to disk: gaze samples, fixation events, steering
+    commands and game events.
+
+    Recording a row only copies it into the current chunk of its stream
+    and player, so it is safe and cheap on the SDK's callback thread. Full
+    chunks go through a queue of at most `maxchunks` to a background
+    thread, which turns them into columns, compresses them with
+    `compression` ('zlib' or None) and appends them to the file. Partial
+    chunks are written every `flushinterval` seconds. When the writer falls
+    that far behind, chunks are dropped (and counted in `dropped`) rather
+    than blocking the caller.
+
+    param `clock`: callable returning milliseconds, used to stamp commands
+    and game events; pass the tracker's TimeBase.now so they share the
+    samples' time line
+    '''
+    def __init__(self, path=None, compression=c.RECORDCOMPRESSION, chunkrows=c.RECORDCHUNKROWS,
+                 maxchunks=c.RECORDQUEUESIZE, flushinterval=c.RECORDFLUSHINTERVAL, clock=None):
+        if compression not in CODECS:
+            raise ValueError('unknown compression %r, expected one of %s' % (compression, list(CODECS)))
+        self.path = path if path is not None else session_path()
+        self.codec = CODECS[compression]
+        self.chunkrows = chunkrows
+        self.flushinterval = flushinterval
+        self.clock = clock if clock is not None else _millis
+        self.dropped = 0
+        self.written = 0
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._file = open(self.path, 'wb')
+        schema = json.dumps({
+            'streams': OrderedDict((name, {'id': i, 'fields': _fields(dtype)})
+                                   for i, (name, dtype) in enumerate(STREAMS.items())),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }).encode()
+        self._file.write(MAGIC + struct.pack('<I', len(schema)) + schema)
+
+        self._ids = dict((name, i) for i, name in enumerate(STREAMS))
+        self._chunks = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxchunks)
+        self._writer = threading.Thread(target=self._write, name='session-writer', daemon=True)
+        self._writer.start()
+
+    def record(self, stream, row, player=0):
+        with self._lock:
+            key = (stream, player)
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                chunk = self._chunks[key] = [np.empty(self.chunkrows, dtype=STREAMS[stream]), 0]
+            chunk[0][chunk[1]] = row
+            chunk[1] += 1
+            if chunk[1] == self.chunkrows:
+                del self._chunks[key]
+                self._submit(stream, player, chunk[0])
+
+    def _submit(self, stream, player, rows):
+        try:
+            self._queue.put_nowait((stream, player, rows))
+        except queue.Full:
+            self.dropped += len(rows)
+
+    def sample(self, gaze_sample, player=0):
+        self.record(SAMPLES, gaze_sample, player)
+
+    def event(self, event, player=0):
+        self.record(EVENTS, event_row(event), player)
+
+    def command(self, command, player=0):
+        event = command.event
+        self.record(COMMANDS, (self.clock(), command.direction, event.stime,
+                               np.nan if event.etime is None else event.etime, event.x, event.y), player)
+
+    def game(self, kind, cell=(-1, -1), length=0, player=0):
+        self.record(GAME, (self.clock(), GAME_KINDS.index(kind), cell[0], cell[1], length), player)
+
+    def attach(self, tracker, player=0):
+        '''
+        Record `tracker`'s samples and fixation events as `player`'s.
+        `tracker` is a Tracker or a GazeProcess; both call their `recorder`
+        with every sample.
+        '''
+        tracker.recorder = functools.partial(self.sample, player=player)
+        tracker.fixation_detector.subscribe(functools.partial(self.event, player=player))
+
+    def flush(self):
+        # hand the partial chunks to the writer
+        with self._lock:
+            chunks, self._chunks = self._chunks, {}
+            for (stream, player), (rows, n) in chunks.items():
+                self._submit(stream, player, rows[:n])
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+    def _write(self):
+        deadline = time.monotonic() + self.flushinterval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = ()
+            if time.monotonic() >= deadline:
+                # on schedule, however busy the queue is with full chunks of other streams
+                self.flush()
+                deadline = time.monotonic() + self.flushinterval
+            if item is None:
+                return
+            if item:
+                self._write_chunk(*item)
+
+    def _write_chunk(self, stream, player, rows):
+        payload = b''.join(np.ascontiguousarray(rows[name]).tobytes() for name in rows.dtype.names)
+        if self.codec == ZLIB:
+            payload = zlib.compress(payload, 1)
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self._ids[stream], player, self.codec,
+                                           len(rows), len(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        self.written += len(rows)
+
+
+class Session(object):
+    '''
+    A recorded session file, read back as NumPy columns.
+
+    Opening it only scans the chunk headers. Uncompressed chunks are views
+    into a memory map of the file; compressed ones are inflated as they are
+    read. `load()` concatenates a stream's chunks, `chunks()` streams them.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self._map[:len(MAGIC)]) != MAGIC:
+            raise ValueError('%s is not a session file' % path)
+        offset = len(MAGIC)
+        (length,) = struct.unpack('<I', bytes(self._map[offset:offset + 4]))
+        offset += 4
+        self.schema = json.loads(bytes(self._map[offset:offset + length]).decode())
+        offset += length
+
+        self.dtypes = OrderedDict()
+        names = {}
+        for name, stream in self.schema['streams'].items():
+            self.dtypes[name] = _dtype(stream['fields'])
+            names[stream['id']] = name
+
+        # (stream, player) -> [(codec, rows, payload offset, payload length)]
+        self.index = OrderedDict()
+        size = len(self._map)
+        while offset + CHUNK_HEADER.size <= size:
+            magic, stream, player, codec, rows, length = CHUNK_HEADER.unpack(
+                bytes(self._map[offset:offset + CHUNK_HEADER.size]))
+            offset += CHUNK_HEADER.size
+            if magic != CHUNK_MAGIC or offset + length > size:
+                # torn write at the end of a session that did not close
+                break
+            self.index.setdefault((names[stream], player), []).append((codec, rows, offset, length))
+            offset += length
+
+    def players(self, stream):
+        return sorted(player for name, player in self.index if name == stream)
+
+    def __len__(self):
+        return sum(rows for chunks in self.index.values() for codec, rows, offset, length in chunks)
+
+    def _columns(self, dtype, codec, rows, offset, length, columns):
+        payload = self._map[offset:offset + length]
+        if codec == ZLIB:
+            payload = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+        out = OrderedDict()
+        position = 0
+        for name in dtype.names:
+            field = dtype[name]
+            nbytes = rows * field.itemsize
+            if columns is None or name in columns:
+                column = payload[position:position + nbytes].view(field.base)
+                out[name] = column.reshape((rows,) + field.shape)
+            position += nbytes
+        return out
+
+    def chunks(self, stream, player=0, columns=None):
+        # one dict of columns per chunk, in recording order
+        dtype = self.dtypes[stream]
+        for chunk in self.index.get((stream, player), []):
+            yield self._columns(dtype, *chunk, columns=columns)
+
+    def load(self, stream, player=0, columns=None):
+        '''
+        Every row of `stream` for `player` as a dict of column arrays, which
+        can be indexed by field name like the structured arrays elsewhere
+        (e.g. gazebuffer.gaze_points(session.load(SAMPLES), dispsize))
+        '''
+        dtype = self.dtypes[stream]
+        names = [name for name in dtype.names if columns is None or name in columns]
+        parts = list(self.chunks(stream, player, columns))
+        if not parts:
+            return OrderedDict((name, np.empty((0,) + dtype[name].shape, dtype[name].base)) for name in names)
+        return OrderedDict((name, np.concatenate([part[name] for part in parts])) for name in names)
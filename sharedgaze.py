@@ -0,0 +1,276 @@
+import constants as c
+
+from multiprocessing import shared_memory
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+from gazebuffer import GazeBuffer, GAZE_DTYPE
+from fixation import EVENT_DTYPE, event_row, event_from_row
+from latency import TimeBase, LatencyTrace
+from publisher import Publisher
+import backend
+
+tr = backend.load_backend()
+
+# Capture in a separate process: the child runs the Tracker (SDK callback,
+# gap filling, velocity and fixation/dwell detection) and publishes samples
+# and fixation events through single-writer rings in shared memory. The game
+# process reads them without copying and without a lock shared with the
+# writer, so a slow frame never holds up sample handling and the two sides
+# run on separate cores.
+#
+# Each ring starts with a header of int64 [count, capacity]. The writer fills
+# the row for item `count` (twice, like GazeBuffer) and only then publishes
+# count + 1. A reader can use rows from item `first` on until the writer
+# starts on item first + capacity, so it checks `intact(first)` after using
+# a view, as a seqlock reader checks its sequence number.
+
+_HEADER = 64  # bytes, keeps the rows aligned
+
+
+def _create(capacity, dtype):
+    shm = shared_memory.SharedMemory(create=True, size=_HEADER + 2 * capacity * dtype.itemsize)
+    np.ndarray((2,), np.int64, buffer=shm.buf)[:] = (0, capacity)
+    return shm
+
+
+def _capacity(shm):
+    return int(np.ndarray((2,), np.int64, buffer=shm.buf)[1])
+
+
+def _views(shm, capacity, dtype):
+    header = np.ndarray((2,), np.int64, buffer=shm.buf)
+    data = np.ndarray((2 * capacity,), dtype, buffer=shm.buf, offset=_HEADER)
+    return header, data
+
+
+def _release(shm, owner):
+    try:
+        shm.close()
+    except BufferError:
+        # a caller still holds a view; the mapping goes away with the process
+        pass
+    if owner:
+        shm.unlink()
+
+
+class SharedGazeBuffer(GazeBuffer):
+    '''
+    GazeBuffer whose rows and count live in shared memory.
+
+    Create it without `name` in one process and attach to it by `name` from
+    others. Exactly one process writes (the capture process's Tracker);
+    readers use the usual GazeBuffer views, and `intact(first)` tells
+    whether rows from item `first` on survived while they were used.
+    '''
+    def __init__(self, name=None, capacity=None, **kwargs):
+        self._shm = None
+        self._owner = name is None
+        if name is not None:
+            self._shm = shared_memory.SharedMemory(name=name)
+            capacity = _capacity(self._shm)
+        GazeBuffer.__init__(self, capacity=capacity, **kwargs)
+
+    def _allocate(self):
+        if self._shm is None:
+            self._shm = _create(self.capacity, GAZE_DTYPE)
+        self._header, self._data = _views(self._shm, self.capacity, GAZE_DTYPE)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def _count(self):
+        return int(self._header[0])
+
+    @_count.setter
+    def _count(self, count):
+        self._header[0] = count
+
+    def intact(self, first):
+        return self._count - self.capacity < first
+
+    def wait_for_samples(self, since=None, timeout=None):
+        # the writer is in another process and cannot notify our lock, so poll
+        if since is None:
+            since = self._count
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            count = self._count
+            if count != since or (deadline is not None and time.monotonic() >= deadline):
+                return count
+            time.sleep(c.SHAREDPOLLINTERVAL)
+
+    def close(self):
+        # drop every view taken from the buffer first
+        self._header = self._data = None
+        _release(self._shm, self._owner)
+
+
+class SharedEventRing(object):
+    '''
+    Shared-memory ring of FixationEvents, one writer, any number of readers;
+    see the module comment for the protocol.
+    '''
+    def __init__(self, name=None, capacity=c.SHAREDEVENTCAPACITY):
+        self._owner = name is None
+        if name is None:
+            self._shm = _create(capacity, EVENT_DTYPE)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            capacity = _capacity(self._shm)
+        self.capacity = capacity
+        self._header, self._data = _views(self._shm, capacity, EVENT_DTYPE)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def count(self):
+        return int(self._header[0])
+
+    def intact(self, first):
+        return self.count - self.capacity < first
+
+    def append(self, event):
+        count = self.count
+        i = count % self.capacity
+        self._data[i] = event_row(event)
+        self._data[i + self.capacity] = self._data[i]
+        self._header[0] = count + 1
+
+    def read(self, since):
+        '''
+        Rows of the events from item `since` on, as a view, with the item
+        number of the first row and the count after the last; older items
+        the writer already overwrote are skipped
+        '''
+        count = self.count
+        first = min(max(since, count - self.capacity), count)
+        end = (count - 1) % self.capacity + self.capacity + 1
+        return self._data[end - (count - first):end], first, count
+
+    def events(self, since):
+        # FixationEvents from item `since` on, and the count to continue from
+        rows, first, count = self.read(since)
+        events = [event_from_row(*row) for row in rows.tolist()]
+        lost = self.count - self.capacity - first
+        if lost > 0:
+            # overwritten while we copied them out
+            events = events[lost:]
+        return events, count
+
+    def close(self):
+        self._header = self._data = None
+        _release(self._shm, self._owner)
+
+
+def _capture(user, config, serial, samples_name, events_name, stop):
+    # runs in the capture process
+    from tracker import Tracker
+    from trackermanager import find_eyetrackers
+    eyetracker = find_eyetrackers([serial])[0] if serial is not None else None
+    samples = SharedGazeBuffer(samples_name, decimation=c.GAZEDECIMATION, origins=False)
+    events = SharedEventRing(events_name)
+    tracker = Tracker(user, eyetracker=eyetracker, config=config, gaze_data=samples)
+    tracker.fixation_detector.subscribe(events.append)
+    tracker.start_recording()
+    try:
+        stop.wait()
+    finally:
+        tracker.stop_recording()
+        tracker.fixation_detector.unsubscribe(events.append)
+        samples.close()
+        events.close()
+
+
+class EventFeed(Publisher):
+    # the FixationDetector's subscriber interface, fed from the event ring
+    pass
+
+
+class GazeProcess(object):
+    '''
+    Stands in for a Tracker in the game process while the real one runs in
+    a child process.
+
+    It offers what the game uses: `fixation_detector` to subscribe to
+    (events arrive on a reader thread, as they do on the SDK's callback
+    thread), `gaze_data` (a SharedGazeBuffer reader), `recorder`,
+    `timebase`, `latency` and start_recording()/stop_recording(). The
+    TRACKER and DETECTOR stages are measured in the child and do not show
+    up in `latency`. The `recorder` is called with every sample the reader
+    thread finds in `gaze_data`, in order.
+
+    param `config`: threshold config; defaults to the user's cached calibration
+    param `serial`: serial number of the eye tracker; defaults to the first one found
+    '''
+    def __init__(self, user, config=None, serial=None):
+        self.user = user
+        self.config = config
+        self.serial = serial
+        self.timebase = TimeBase(tr)
+        self.latency = LatencyTrace()
+        self.fixation_detector = EventFeed()
+        self.gaze_data = None
+        self.recorder = None
+        self.events = None
+        self.process = None
+        self.recording = False
+        self._stop = None
+        self._reader = None
+
+    def start_recording(self):
+        self.gaze_data = SharedGazeBuffer(decimation=c.GAZEDECIMATION, origins=False)
+        self.events = SharedEventRing()
+        self._stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=_capture, name='gaze-capture', daemon=True,
+                                               args=(self.user, self.config, self.serial, self.gaze_data.name,
+                                                     self.events.name, self._stop))
+        self.process.start()
+        self._reader = threading.Thread(target=self._read_events, name='gaze-events', daemon=True)
+        self._reader.start()
+        self.recording = True
+
+    def stop_recording(self):
+        if self.process is None:
+            return
+        self._stop.set()
+        self._reader.join()
+        self.process.join()
+        self.process = None
+        self.recording = False
+        self.gaze_data.close()
+        self.events.close()
+
+    def _read_events(self):
+        seen = recorded = 0
+        while not self._stop.is_set():
+            events, seen = self.events.events(seen)
+            for event in events:
+                self.fixation_detector._emit(event)
+            if self.recorder is not None:
+                recorded = self._record_samples(recorded)
+            if not events:
+                time.sleep(c.SHAREDPOLLINTERVAL)
+        if self.recorder is not None:
+            self._record_samples(recorded)
+
+    def _record_samples(self, seen):
+        # hand the samples written since `seen` to the recorder and return
+        # the new count; rows the ring overwrote before they were read are lost
+        count = self.gaze_data.count
+        if count < seen:
+            # the buffer was cleared
+            seen = 0
+        rows = self.gaze_data.last(count - seen).copy()
+        first = count - len(rows)
+        rows = rows[max(0, self.gaze_data.count - self.gaze_data.capacity - first):]
+        for row in rows:
+            self.recorder(row)
+        return count
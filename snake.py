@@ -1,10 +1,18 @@
 from pygame.locals import *
-from random import randint
+from collections import deque
 import pygame
-import time
-from tracker import Tracker
-from calibrate import calibrate_user
-from queue import Queue
+import sys
+import constants as c
+from trackermanager import TrackerManager
+from gazepipeline import GazePipeline
+from latency import APPLY, FRAME, TOTAL
+from steering import SteeringEngine
+from freecells import FreeCells
+from renderer import DirtyRenderer
+from scheduler import FixedTimestep
+from sessionlog import SessionRecorder
+from heatmap import GazeHeatmaps, heatmap_path, phase
+import asyncio
  
 class Apple:
     x = 0
@@ -15,51 +23,64 @@ class Apple:
         self.x = x * self.step
         self.y = y * self.step
  
-    def draw(self, surface, image):
-        surface.blit(image,(self.x, self.y)) 
- 
  
 class Player:
-    x = [0]
-    y = [0]
     step = 44
-    direction = 0
-    length = 3
- 
-    updateCountMax = 2
-    updateCount = 0
+
+    # head moves per direction: right, left, up, down
+    MOVES = ((1, 0), (-1, 0), (0, -1), (0, 1))
  
-    def __init__(self, length):
+    def __init__(self, length, cells=None, row=0):
        self.length = length
-       for i in range(0,2000):
-           self.x.append(-100)
-           self.y.append(-100)
- 
-       # initial positions, no collision.
-       self.x[1] = 1*44
-       self.x[2] = 2*44
- 
+       self.direction = 0
+       self.crashed = False
+
+       # direction of the last move; the snake cannot turn back against it
+       self.heading = 0
+
+       # cells head first, and the set of them for O(1) lookups; the body
+       # starts off-screen to the left and slides in
+       self.body = deque((-i * self.step, row * self.step) for i in range(length))
+       self.occupied = set(self.body)
+
+       # cells entered or vacated since the last frame was drawn
+       self.changed = []
+       # cell the tail left on the last move, or None
+       self.vacated = None
+
+       # the board's FreeCells; the game keeps it in sync after every move
+       self.cells = cells
+       if cells is not None:
+           for cell in self.body:
+               cells.discard(cell)
+ 
+    def head(self):
+        return self.body[0]
+
+    def occupies(self, x, y):
+        return (x, y) in self.occupied
+
     def update(self):
- 
-        self.updateCount = self.updateCount + 1
-        if self.updateCount > self.updateCountMax:
- 
-            # update previous positions
-            for i in range(self.length-1,0,-1):
-                self.x[i] = self.x[i-1]
-                self.y[i] = self.y[i-1]
- 
-            # update position of head of snake
-            if self.direction == 0:
-                self.x[0] = self.x[0] + self.step
-            if self.direction == 1:
-                self.x[0] = self.x[0] - self.step
-            if self.direction == 2:
-                self.y[0] = self.y[0] - self.step
-            if self.direction == 3:
-                self.y[0] = self.y[0] + self.step
- 
-            self.updateCount = 0
+        # one move; the game's FixedTimestep decides when
+ 
+        # the tail moves out before the head moves in
+        self.vacated = None
+        if len(self.body) >= self.length:
+            tail = self.body.pop()
+            self.occupied.discard(tail)
+            self.changed.append(tail)
+            self.vacated = tail
+
+        # update position of head of snake
+        dx, dy = self.MOVES[self.direction]
+        x, y = self.body[0]
+        head = (x + dx * self.step, y + dy * self.step)
+        if head in self.occupied:
+            self.crashed = True
+        self.body.appendleft(head)
+        self.occupied.add(head)
+        self.changed.append(head)
+        self.heading = self.direction
  
  
     def moveRight(self):
@@ -74,128 +95,263 @@ class Player:
     def moveDown(self):
         self.direction = 3 
  
-    def draw(self, surface, image):
-        for i in range(0,self.length):
-            surface.blit(image,(self.x[i],self.y[i])) 
- 
-class Game:
-    def isCollision(self,x1,y1,x2,y2,bsize):
-        if x1 >= x2 and x1 <= x2 + bsize:
-            if y1 >= y2 and y1 <= y2 + bsize:
-                return True
-        return False
- 
 import os
 
 class Snake:
  
     windowWidth = 1920
     windowHeight = 1080
- 
-    def __init__(self):
+
+    # tints that tell the players' snakes apart
+    PLAYERCOLORS = ((255, 255, 255), (120, 180, 255), (255, 170, 90), (170, 255, 120))
+ 
+    def __init__(self, eyetracker=None, eyetrackers=None, recorder=None):
+        # one player per eye tracker, and at least one
+        if eyetrackers is None:
+            eyetrackers = [eyetracker] if eyetracker is not None else []
+        self.eyetrackers = list(eyetrackers)
+        self.eyetracker = self.eyetrackers[0] if self.eyetrackers else None
+        # sessionlog.SessionRecorder for steering and game events, or None
+        self.recorder = recorder
+        # where each player looked, see heatmap.py
+        self.heatmaps = [GazeHeatmaps() for eyetracker in self.eyetrackers] if c.HEATMAP else []
         self._running = True
         self._display_surf = None
         self._image_surf = None
+        self._player_surfs = []
         self._apple_surf = None
-        self.game = Game()
-        self.player = Player(3) 
-        self.apple = Apple(5,5)
+        self.renderer = None
+        self.scheduler = None
+        self.dirty = []
+        self.cells = FreeCells(self.windowWidth // Player.step, self.windowHeight // Player.step, Player.step)
+        self.steerings = [SteeringEngine(self.windowWidth, self.windowHeight, Player.step)
+                          for i in range(max(1, len(self.eyetrackers)))]
+        self.new_game()
         self.RESOURCES = 'resources'
+
+    @property
+    def player(self):
+        return self.players[0]
+
+    @property
+    def steering(self):
+        return self.steerings[0]
+
+    def new_game(self):
+        self.cells.clear()
+        # players start on rows spread over the board
+        rows = self.cells.rows
+        self.players = [Player(3, self.cells, row=k * rows // len(self.steerings))
+                        for k in range(len(self.steerings))]
+        if self.recorder is not None:
+            self.recorder.game('new_game')
+        self.apples = {}
+        for i in range(c.APPLES):
+            self.spawn_apple()
+        for steering in self.steerings:
+            steering.reset()
+        if self.renderer is not None:
+            self.renderer.invalidate()
+
+    def spawn_apple(self):
+        # on a free cell anywhere on the board; none once the board is full
+        cell = self.cells.choice()
+        if cell is None:
+            return None
+        self.cells.discard(cell)
+        apple = Apple(cell[0] // Apple.step, cell[1] // Apple.step)
+        self.apples[cell] = apple
+        self.dirty.append(cell)
+        if self.recorder is not None:
+            self.recorder.game('spawn', cell)
+        return apple
  
     def on_init(self):
         pygame.init()
-        #self._display_surf = pygame.display.set_mode((self.windowWidth,self.windowHeight), pygame.HWSURFACE)
-        self._display_surf = pygame.Surface((windowWidth, windowHeight))
-        self._display_surf.fill('#000000')
+        self._display_surf = pygame.display.set_mode((self.windowWidth,self.windowHeight), pygame.HWSURFACE)
+        self.renderer = DirtyRenderer(self._display_surf, Player.step)
 
         self._running = True
         self._image_surf = pygame.image.load(os.path.join(self.RESOURCES, "snake.jpg")).convert()
         self._apple_surf = pygame.image.load(os.path.join(self.RESOURCES, "food.jpg")).convert()
+        self._player_surfs = []
+        for k in range(len(self.players)):
+            surf = self._image_surf.copy()
+            surf.fill(self.PLAYERCOLORS[k % len(self.PLAYERCOLORS)], special_flags=BLEND_MULT)
+            self._player_surfs.append(surf)
  
     def on_event(self, event):
         if event.type == QUIT:
             self._running = False
+        elif event.type == VIDEOEXPOSE and self.renderer is not None:
+            self.renderer.invalidate()
  
     def on_loop(self):
-        self.player.update()
- 
-        # does snake eat apple?
-        for i in range(0,self.player.length):
-            if self.game.isCollision(self.apple.x,self.apple.y,self.player.x[i], self.player.y[i],44):
-                self.apple.x = randint(2,9) * 44
-                self.apple.y = randint(2,9) * 44
-                self.player.length = self.player.length + 1
- 
- 
-        # does snake collide with itself?
-        for i in range(2,self.player.length):
-            if self.game.isCollision(self.player.x[0],self.player.y[0],self.player.x[i], self.player.y[i],40):
+        for player in self.players:
+            player.update()
+
+        # free cells once every snake has moved: a tail one snake left may
+        # already hold the head of another
+        for player in self.players:
+            self.cells.discard(player.head())
+        for player in self.players:
+            tail = player.vacated
+            if tail is not None and not any(other.occupies(*tail) for other in self.players):
+                self.cells.add(tail)
+ 
+        for k, player in enumerate(self.players):
+            # does snake eat apple?
+            if self.apples.pop(player.head(), None) is not None:
+                player.length = player.length + 1
+                if self.recorder is not None:
+                    self.recorder.game('eat', player.head(), player.length, k)
+                self.spawn_apple()
+
+            # does snake run into another snake?
+            for other in self.players:
+                if other is not player and other.occupies(*player.head()):
+                    player.crashed = True
+ 
+            # does snake collide with itself?
+            if player.crashed:
+                if self.recorder is not None:
+                    self.recorder.game('crash', player.head(), player.length, k)
                 print("You lose! Collision: ")
-                print("x[0] (" + str(self.player.x[0]) + "," + str(self.player.y[0]) + ")")
-                print("x[" + str(i) + "] (" + str(self.player.x[i]) + "," + str(self.player.y[i]) + ")")
+                if len(self.players) > 1:
+                    print("player " + str(k + 1))
+                print("head (" + str(player.head()[0]) + "," + str(player.head()[1]) + ")")
                 exit(0)
  
         pass
  
     def on_render(self):
-        self._display_surf.fill((0,0,0))
-        self.player.draw(self._display_surf, self._image_surf)
-        self.apple.draw(self._display_surf, self._apple_surf)
-        pygame.display.flip()
+        dirty = self.dirty
+        for player in self.players:
+            dirty += player.changed
+            player.changed = []
+        self.dirty = []
+        self.renderer.render(dirty, self._sprite, self._sprites)
+
+    def _sprite(self, cell):
+        if cell in self.apples:
+            return self._apple_surf
+        for k, player in enumerate(self.players):
+            if player.occupies(*cell):
+                return self._player_surfs[k]
+        return None
+
+    def _sprites(self):
+        for k, player in enumerate(self.players):
+            for cell in player.body:
+                yield self._player_surfs[k], cell
+        for cell in self.apples:
+            yield self._apple_surf, cell
  
     def on_cleanup(self):
-        self.eyetracker.stop_recording()
+        for eyetracker in self.eyetrackers:
+            eyetracker.stop_recording()
+        if self.recorder is not None:
+            self.recorder.close()
+        for k, heatmaps in enumerate(self.heatmaps):
+            if self.recorder is not None:
+                path = '%s-heatmap-%d.npz' % (os.path.splitext(self.recorder.path)[0], k)
+            else:
+                path = heatmap_path(k)
+            heatmaps.save(path)
         pygame.quit()
  
     import sys
 
-    def listen_for_fixations(self, fixation_point_queue):
-        while True:
-            stime, etime, spos = self.eyetracker.get_fixation()
-            fixation_time = etime - stime
-            fixation_point_queue.put(fixation_time, spos)
+    def get_direction(self, fixation_points, player=0):
+        steering, player = self.steerings[player], self.players[player]
+        return steering.feed(fixation_points, player.heading, player.head())
 
-    def get_direction(self, fixation_points):
-        fixation_points.sort(key=lambda fixation_point: fixation_point[0], reverse=True)
-        direction = fixation_points[0]
-        print(direction)
+    def steer(self, direction, player=0):
+        player = self.players[player]
+        (player.moveRight, player.moveLeft, player.moveUp, player.moveDown)[direction]()
 
     def on_execute_eye_tracking(self):
+        asyncio.run(self.run_eye_tracking())
+
+    async def run_eye_tracking(self):
         if self.on_init() == False:
             self._running = False
 
-        # Put eye code here
-        fixation_point_queue = Queue()
+        # fixations -> steering commands, on this event loop; one pipeline per
+        # eye tracker, steering its own player
+        pipelines = [GazePipeline(eyetracker) for eyetracker in self.eyetrackers]
+        steerings = []
+        for k, pipeline in enumerate(pipelines):
+            pipeline.start()
+            steerings.append(asyncio.ensure_future(
+                pipeline.steer(lambda events, k=k: self.get_direction(events, k))))
 
-        import threading
-        thread = threading.Thread(target=self.listen_for_fixations, args=(fixation_point_queue,))
-        thread.start()
- 
-        while( self._running ):
-            pygame.event.pump()
+        # input and rendering every frame, snakes move every SIMSTEP
+        framestep = 1000.0 / c.FRAMERATE
+        scheduler = self.scheduler = FixedTimestep()
+        pending = [None] * len(pipelines)
 
-            fixations = []
-            while not fixation_point_queue.empty():
-                fixations.append(fixation_point_queue.get())
+        try:
+            while( self._running ):
+                frame = scheduler.clock()
+                for event in pygame.event.get():
+                    self.on_event(event)
 
-            if fixations:
-                direction = self.get_direction(fixations)
- 
-            self.on_loop()
-            self.on_render()
- 
-            time.sleep (50.0 / 1000.0)
+                # turn right away; the move happens on the next tick
+                for k, pipeline in enumerate(pipelines):
+                    command = pipeline.commands.get_nowait()
+                    if command is not None:
+                        self.steer(command.direction, k)
+                        pending[k] = (command, self.eyetrackers[k].timebase.now())
+                        if self.recorder is not None:
+                            self.recorder.command(command, k)
 
+                for k, heatmaps in enumerate(self.heatmaps):
+                    player = self.players[k]
+                    x, y = player.head()
+                    heatmaps.update(self.eyetrackers[k].gaze_data, phase(player.length),
+                                    (x + Player.step / 2.0, y + Player.step / 2.0))
 
-        self.on_cleanup()
- 
-user = 'robert'
+                ticks = scheduler.advance(frame)
+                for tick in range(ticks):
+                    self.on_loop()
+                applied = [eyetracker.timebase.now() for eyetracker in self.eyetrackers]
+                self.on_render()
+                flipped = [eyetracker.timebase.now() for eyetracker in self.eyetrackers]
+                scheduler.frame_done()
+
+                for k, eyetracker in enumerate(self.eyetrackers):
+                    if pending[k] is not None and ticks:
+                        command, taken = pending[k]
+                        eyetracker.latency.record(APPLY, taken, applied[k])
+                        eyetracker.latency.record(FRAME, applied[k], flipped[k])
+                        eyetracker.latency.record(TOTAL, command.event.etime, flipped[k])
+                        pending[k] = None
+
+                # wake for the next frame, or earlier if a tick is due first
+                wake = min(frame + framestep, scheduler.next_tick())
+                await asyncio.sleep(max(0.0, wake - scheduler.clock()) / 1000.0)
+        finally:
+            for pipeline in pipelines:
+                pipeline.stop()
+            for steering in steerings:
+                steering.cancel()
+            await asyncio.gather(*steerings, return_exceptions=True)
+            self.on_cleanup()
+ 
+users = ['robert']
 
 if __name__ == "__main__":
-    snake = Snake()
-    calibrate_user(user)
-    tracker = Tracker(user)
-    tracker.start_recording()
-    
-    tracker.stop_recording()
-    
\ No newline at end of file
+    trackers = TrackerManager(users)
+    if not trackers.calibrate():
+        print('Calibration failed or was cancelled; not starting the game.')
+        sys.exit(1)
+    trackers.open()
+    recorder = None
+    if c.RECORDSESSION:
+        recorder = SessionRecorder(clock=list(trackers)[0].timebase.now)
+        for k, tracker in enumerate(trackers):
+            recorder.attach(tracker, k)
+    trackers.start_recording()
+    snake = Snake(eyetrackers=list(trackers), recorder=recorder)
+    snake.on_execute_eye_tracking()
@@ -0,0 +1,166 @@
+import constants as c
+
+from collections import namedtuple
+import math
+
+import numpy as np
+
+# directions, in the numbering of Player.direction
+RIGHT = 0
+LEFT = 1
+UP = 2
+DOWN = 3
+NONE = -1
+OPPOSITE = (LEFT, RIGHT, DOWN, UP)
+
+HEAD = 'head'
+ZONES = 'zones'
+
+# direction to turn to, and the fixation or dwell event that decided it
+Command = namedtuple('Command', ['direction', 'event'])
+
+
+def region_table(cols, rows, deadzone=0):
+    '''
+    Direction for every cell offset (dx, dy) from an origin cell, for
+    offsets up to `cols` and `rows` cells either way; index it as
+    table[dy + rows, dx + cols]. The dominant axis of the offset picks the
+    direction; offsets within `deadzone` cells of the origin are NONE.
+    '''
+    dy, dx = np.mgrid[-rows:rows + 1, -cols:cols + 1]
+    table = np.where(np.abs(dx) >= np.abs(dy),
+                     np.where(dx > 0, RIGHT, LEFT),
+                     np.where(dy > 0, DOWN, UP)).astype(np.int8)
+    table[np.maximum(np.abs(dx), np.abs(dy)) <= deadzone] = NONE
+    return table
+
+
+class SteeringEngine(object):
+    '''
+    Turns fixation/dwell events into steering commands in constant time per
+    event.
+
+    Each event is placed on the board grid (`cellsize` pixels per cell) and
+    looked up in a precomputed region table, relative to the snake's head
+    (mode HEAD) or to the centre of the board (mode ZONES, four triangular
+    screen zones). The direction it points to gets a vote weighted by the
+    fixation's duration so far. Votes decay with a half-life of `halflife`
+    milliseconds, so only recent gaze counts.
+
+    The engine turns when the leading direction is not the current one and
+    its vote is at least `hysteresis` times the vote for the current
+    direction. The snake cannot turn back on itself, so when the lead is
+    the reverse it turns sideways instead: to the perpendicular direction
+    with more votes, or else to the side the gaze is on (towards the board
+    centre for gaze straight behind), and can complete the U-turn on a
+    later move.
+
+    param `dispsize`: size of the display the fixation coordinates are in;
+    they are scaled to the `width` x `height` board
+    '''
+    def __init__(self, width, height, cellsize, mode=c.STEERINGMODE, halflife=c.STEERINGHALFLIFE,
+                 hysteresis=c.STEERINGHYSTERESIS, deadzone=c.STEERINGDEADZONE, dispsize=c.DISPSIZE):
+        if mode not in (HEAD, ZONES):
+            raise ValueError('unknown steering mode %r, expected %r or %r' % (mode, HEAD, ZONES))
+        self.mode = mode
+        self.cellsize = cellsize
+        self.cols = int(math.ceil(width / float(cellsize)))
+        self.rows = int(math.ceil(height / float(cellsize)))
+        self.hysteresis = hysteresis
+        self._scale = (width / float(dispsize[0]), height / float(dispsize[1]))
+        self._decay = math.log(2) / halflife
+        self._table = region_table(self.cols, self.rows, deadzone).tolist()
+        self._center = (self.cols // 2, self.rows // 2)
+        self.reset()
+
+    def reset(self):
+        self._votes = [0.0, 0.0, 0.0, 0.0]
+        self._t = None
+
+    def votes(self):
+        return list(self._votes)
+
+    def region(self, x, y, head=None):
+        '''
+        Direction of the display point (x, y), seen from `head` (board
+        pixels) in HEAD mode or from the board centre in ZONES mode
+        '''
+        dx, dy, origin = self._offset(x, y, head)
+        return self._table[dy + self.rows][dx + self.cols]
+
+    def _offset(self, x, y, head):
+        # cell offset of (x, y) from the origin cell, and the origin cell
+        col = int(x * self._scale[0]) // self.cellsize
+        row = int(y * self._scale[1]) // self.cellsize
+        if self.mode == HEAD and head is not None:
+            origin = (int(head[0]) // self.cellsize, int(head[1]) // self.cellsize)
+        else:
+            origin = self._center
+        dx = min(max(col - origin[0], -self.cols), self.cols)
+        dy = min(max(row - origin[1], -self.rows), self.rows)
+        return dx, dy, origin
+
+    def sideways(self, current, x, y, head=None):
+        '''
+        Direction perpendicular to `current` on the side of the display
+        point (x, y), or towards the board centre if it is straight ahead or
+        behind
+        '''
+        dx, dy, origin = self._offset(x, y, head)
+        if current in (RIGHT, LEFT):
+            minor = dy or self._center[1] - origin[1]
+            return DOWN if minor > 0 else UP
+        minor = dx or self._center[0] - origin[0]
+        return RIGHT if minor > 0 else LEFT
+
+    def vote(self, direction, weight, t):
+        if self._t is not None and t > self._t:
+            decay = math.exp(-self._decay * (t - self._t))
+            votes = self._votes
+            for d in range(4):
+                votes[d] *= decay
+        if self._t is None or t > self._t:
+            self._t = t
+        self._votes[direction] += weight
+
+    def decide(self, current, sideways=None):
+        '''
+        Direction to turn to from `current`, or None to keep going;
+        `sideways` is the turn to take when the lead is the reverse of
+        `current` and the perpendicular votes are tied
+        '''
+        votes = self._votes
+        best = max(range(4), key=votes.__getitem__)
+        if best == current or not votes[best]:
+            return None
+        if votes[best] < self.hysteresis * votes[current]:
+            return None
+        if best == OPPOSITE[current]:
+            a, b = (UP, DOWN) if current in (RIGHT, LEFT) else (RIGHT, LEFT)
+            if votes[a] != votes[b]:
+                return a if votes[a] > votes[b] else b
+            return sideways
+        return best
+
+    def feed(self, events, current, head=None):
+        '''
+        Vote with `events` and return a Command if the snake, heading in
+        direction `current` with its head at `head`, should turn
+        '''
+        command = None
+        heading = current
+        for event in events:
+            direction = self.region(event.x, event.y, head)
+            if direction == NONE:
+                continue
+            self.vote(direction, max(event.etime - event.stime, 1), event.etime)
+            sideways = None
+            if direction == OPPOSITE[current]:
+                sideways = self.sideways(current, event.x, event.y, head)
+            turn = self.decide(current, sideways)
+            # later events may lead elsewhere, but never back against the
+            # heading the snake actually has
+            if turn is not None and turn != OPPOSITE[heading]:
+                command = Command(turn, event)
+                current = turn
+        return command
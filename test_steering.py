@@ -0,0 +1,45 @@
+import unittest
+
+from fixation import FixationEvent, DWELL
+from steering import SteeringEngine, HEAD, RIGHT, LEFT, UP, DOWN
+
+WIDTH, HEIGHT, CELL = 1920, 1080, 44
+
+
+def dwell(x, y, t, duration=200):
+    return FixationEvent(DWELL, t - duration, t, x, y)
+
+
+class TestSteering(unittest.TestCase):
+    def setUp(self):
+        self.engine = SteeringEngine(WIDTH, HEIGHT, CELL, mode=HEAD, dispsize=(WIDTH, HEIGHT))
+
+    def hold(self, x, y, heading, head, n=5):
+        # gaze held at (x, y) for n dwells; the commands the engine gives
+        return [self.engine.feed([dwell(x, y, 1000 + 250 * i)], heading, head) for i in range(n)]
+
+    def test_gaze_ahead_of_the_side_turns(self):
+        commands = self.hold(1000, 100, RIGHT, (880, 528))
+        self.assertEqual(commands[0].direction, UP)
+
+    def test_gaze_behind_the_head_turns_sideways(self):
+        # heading right, looking left of the head and a little below
+        commands = [command for command in self.hold(300, 700, RIGHT, (880, 528)) if command is not None]
+        self.assertTrue(commands)
+        self.assertEqual(commands[0].direction, DOWN)
+        self.assertNotIn(LEFT, [command.direction for command in commands])
+
+    def test_gaze_straight_behind_turns_towards_the_centre(self):
+        # head in the top half, so the centre is below
+        commands = [command for command in self.hold(100, 100, RIGHT, (880, 88)) if command is not None]
+        self.assertEqual(commands[0].direction, DOWN)
+
+    def test_u_turn_completes_after_the_sideways_move(self):
+        head = (880, 528)
+        first = [command for command in self.hold(300, 700, RIGHT, head) if command is not None][0]
+        second = self.engine.feed([dwell(300, 700, 3000)], first.direction, (head[0], head[1] + CELL))
+        self.assertEqual(second.direction, LEFT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+import constants as c
+import mocktracker
+from gazebuffer import GazeBuffer, gaze_points
+from velocity import classify, VelocityClassifier, SACCADE, BLINK
+
+# thresholds as a calibration would produce them for SCREENDIST/SCREENSIZE
+PXSPDTRESH = 1.9
+PXACCTRESH = 0.526
+RATES = (60, 120, 300, 600)
+SECONDS = 60
+
+
+def synthetic(samplerate, seconds=SECONDS, seed=1):
+    # t (microseconds), x, y of a SyntheticGaze recording
+    gaze_data = GazeBuffer(capacity=samplerate * seconds)
+    source = iter(mocktracker.SyntheticGaze(samplerate=samplerate, seed=seed))
+    for i in range(gaze_data.capacity):
+        gaze_data.append(next(source))
+    rows = gaze_data.window()
+    x, y = gaze_points(rows, c.DISPSIZE)
+    return rows['system_time_stamp'], x, y
+
+
+class TestVelocity(unittest.TestCase):
+    def test_streaming_matches_bulk(self):
+        for rate in RATES:
+            t, x, y = synthetic(rate, seconds=10)
+            classifier = VelocityClassifier(PXSPDTRESH, PXACCTRESH)
+            streamed = [classifier.feed(*sample) for sample in zip(t.tolist(), x.tolist(), y.tolist())]
+            np.testing.assert_array_equal(streamed, classify(t, x, y, PXSPDTRESH, PXACCTRESH))
+
+    def test_saccade_share_independent_of_rate(self):
+        # SyntheticGaze spends about 40 of every 440 ms in a saccade
+        shares = []
+        for rate in RATES:
+            t, x, y = synthetic(rate)
+            labels = classify(t, x, y, PXSPDTRESH, PXACCTRESH)
+            shares.append((labels == SACCADE).sum() / float((labels != BLINK).sum()))
+        self.assertLess(max(shares) - min(shares), 0.03, shares)
+        for share in shares:
+            self.assertGreater(share, 0.05)
+            self.assertLess(share, 0.2)
+
+    def test_still_gaze_is_fixation(self):
+        t = np.arange(600) * 1000000 / 600.0
+        x = 960 + np.random.RandomState(0).normal(0, 2, len(t))
+        y = 540 + np.random.RandomState(1).normal(0, 2, len(t))
+        labels = classify(t, x, y, PXSPDTRESH, PXACCTRESH)
+        self.assertFalse((labels == SACCADE).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,54 +1,88 @@
 import constants as c
-
-from pygaze.libtime import clock
-import tobii_research as tr
-import os
+from gazebuffer import GazeBuffer
+from fixation import FixationDetector, FIXATION_START, FIXATION_END, DWELL
+from velocity import VelocityClassifier, SACCADE, BLINK
+from blink import GapFiller
+from calibstore import CalibrationStore, deg2pix, mean, noise, pixels_per_cm, with_defaults
+from latency import TimeBase, LatencyTrace, TRACKER, DETECTOR
+
+import backend
 import math
 import copy
 import time
-import json
+from queue import Queue, Empty
 
 DEBUG = True
 
+tr = backend.load_backend()
+
 class Tracker(object):
     INVALID = -1
     INVALID_PAIR = (INVALID, INVALID)
+    AVERAGE = 'average'
 
-    def __init__(self, user):
-        try:
-            self.eyetracker = tr.find_all_eyetrackers()[0]
-        except IndexError:
-            if c.DEBUG: print('Restart Tobii eyetracker service. It is currently shut off/unresponsive.')
-            import sys
-            sys.exit(1)
+    '''
+    param `eyetracker`: device to use; defaults to the first one found
+    param `config`: threshold config; defaults to the user's cached calibration
+    param `gaze_data`: GazeBuffer to record into; defaults to a private one
+    '''
+    def __init__(self, user, eyetracker=None, config=None, gaze_data=None):
+        if eyetracker is None:
+            try:
+                eyetracker = tr.find_all_eyetrackers()[0]
+            except IndexError:
+                if c.DEBUG: print('Restart Tobii eyetracker service. It is currently shut off/unresponsive.')
+                import sys
+                sys.exit(1)
+        self.eyetracker = eyetracker
 
         self.screendist = c.SCREENDIST
         
-        self.gaze_data = []
+        if gaze_data is None:
+            gaze_data = GazeBuffer(decimation=c.GAZEDECIMATION, origins=False)
+        self.gaze_data = gaze_data
 
         self.eye_used_default = self.AVERAGE
 
          # maximal distance from fixation start (if gaze wanders beyond this, fixation has stopped)
         self.fixtresh = 0.5  # degrees
-        # amount of time gaze has to linger within self.fixtresh to be marked as a fixation
-        self.spdtresh = 35  # degrees per second
+        # saccade velocity threshold
+        self.spdtresh = c.SACCVELTHRESH  # degrees per second
         # saccade acceleration threshold
-        self.accthresh = 9500  # degrees per second**2
+        self.accthresh = c.SACCACCTHRESH  # degrees per second**2
         # blink detection threshold used in PyGaze method
         
         self.screensize = c.SCREENSIZE  # display size in cm
         self.dispsize = c.DISPSIZE
-        self.pixpercm = (self.dispsize[0] / float(self.screensize[0]) +
-                         self.dispsize[1] / float(self.screensize[1])) / 2.0
+        self.pixpercm = pixels_per_cm(self.dispsize, self.screensize)
         self.errdist = 2  # degrees; maximal error for drift correction
-        self.pxerrdist = self._deg2pix(self.screendist, self.errdist, self.pixpercm)
+        self.pxerrdist = deg2pix(self.screendist, self.errdist, self.pixpercm)
 
         self.terminate = False
 
-        calibration_file = user + '.json'
-        calibration_filepath = os.path.join(c.CALIBRATION_PATH, calibration_file)
-
-        self.config = json.load()
+        # one clock for samples and events, and the per-stage delays measured on it
+        self.timebase = TimeBase(tr)
+        self.latency = LatencyTrace()
+        self._received = None
+        # called with every processed sample, see sessionlog.SessionRecorder.attach()
+        self.recorder = None
+
+        # thresholds and the SDK calibration saved by calibrate.calibrate_user()
+        self.calibration_store = CalibrationStore(user, self.eyetracker.serial_number)
+        if config is None:
+            config = self.calibration_store.load_config()
+            self.calibration_store.apply(self.eyetracker)
+        self.config = with_defaults(config)
+
+        self.fixation_detector = FixationDetector(self.pxfixtresh, self.fixtimetresh,
+                                                  mindwell=c.DWELLTIME, dwellalpha=c.DWELLALPHA,
+                                                  noise=noise(self.pxdsttresh),
+                                                  clock=self.timebase.now)
+        self.fixation_detector.subscribe(self._trace_event)
+        self.velocity_classifier = VelocityClassifier(self.pxspdtresh, self.pxacctresh)
+        self.movement = None
+        self.gap_filler = GapFiller(self.blinkthresh, self._process_point)
+        self.gap_filler.subscribe(self._on_blink)
 
     @property
     def config(self):
@@ -56,6 +90,7 @@ class Tracker(object):
             'pxfixtresh': self.pxfixtresh,
             'fixtimetresh': self.fixtimetresh,
             'pxdsttresh': self.pxdsttresh,
+            'pxspdtresh': self.pxspdtresh,
             'pxacctresh': self.pxacctresh,
             'blinkthresh': self.blinkthresh
         }
@@ -72,34 +107,59 @@ class Tracker(object):
         return self.terminate
     
     def millis(self):
-        return clock.get_time() - self.t0
+        return self.timebase.now()
 
     def is_valid_sample(self, spos):
         return spos != self.INVALID_PAIR
 
-    def start_recording(self):
-        self.gaze_data = []
-        self.eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self._on_gaze_data, as_dictionary=True)
+    def start_recording(self, as_dictionary=c.GAZEASDICTIONARY):
+        self.gaze_data.clear()
+        self.fixation_detector.reset()
+        self.velocity_classifier.reset()
+        self.gap_filler.reset()
+        if as_dictionary:
+            self.eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self._on_gaze_data, as_dictionary=True)
+        else:
+            self.eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self._on_gaze_object, as_dictionary=False)
         time.sleep(1)
         self.recording = True
-        self.t0 = clock.get_time()
 
     def stop_recording(self):
         self.eyetracker.unsubscribe_from(tr.EYETRACKER_GAZE_DATA)
         self.recording = False
 
-    def _deg2pix(self, cmdist, angle, pixpercm):
-        return pixpercm * math.tan(math.radians(angle)) * float(cmdist)
-
     def _on_gaze_data(self, gaze_data):
-        self.gaze_data.append(gaze_data)
+        if self.gaze_data.append(gaze_data):
+            self._process_sample(self.gaze_data.latest())
+
+    def _on_gaze_object(self, gaze_data):
+        if self.gaze_data.append_object(gaze_data):
+            self._process_sample(self.gaze_data.latest())
+
+    def _process_sample(self, gaze_sample):
+        # runs on the SDK's callback thread, once per stored sample
+        self._received = self.timebase.now()
+        self.latency.record(TRACKER, self.timebase.sample_time(gaze_sample['system_time_stamp']), self._received)
+        if self.recorder is not None:
+            self.recorder(gaze_sample)
+        x, y = self.gaze_point(gaze_sample)
+        if not self.is_valid_sample((x, y)):
+            x, y = math.nan, math.nan
+            self.movement = BLINK
+        self.gap_filler.feed(self.timebase.sample_time(gaze_sample['system_time_stamp']), x, y)
 
-    def _mean(self, array):
-        if array:
-            a = [s for s in array if s is not None]
-        else:
-            a = [0]
-        return sum(a) / float(len(a))
+    def _process_point(self, t, x, y):
+        # valid or interpolated samples coming out of the gap filler
+        self.movement = self.velocity_classifier.feed(t * 1000.0, x, y)
+        self.fixation_detector.feed(t, x, y)
+
+    def _trace_event(self, event):
+        if self._received is not None:
+            self.latency.record(DETECTOR, self._received, event.t)
+
+    def _on_blink(self, event):
+        self.velocity_classifier.reset()
+        self.fixation_detector.interrupt(event.stime)
 
     def __enter__ (self):
         return self
@@ -122,11 +182,12 @@ class Tracker(object):
     param `eye`: "right" or "left"
     '''
     def one_eye_gaze_valid(self, eye):
-        return self.gaze_data[-1][eye + "_gaze_point_validity"]
+        return self.gaze_data.latest()[eye + "_gaze_point_validity"]
 
     def one_eye_gaze_sample(self, eye):
-        if self.one_eye_gaze_valid(eye):
-            return self._norm_2_px(self.gaze_data[-1][eye + "_gaze_point_on_display_area"])
+        gaze_sample = self.gaze_data.latest()
+        if gaze_sample[eye + "_gaze_point_validity"]:
+            return self._norm_2_px(gaze_sample[eye + "_gaze_point_on_display_area"])
         else:
             return self.INVALID_PAIR
         
@@ -135,7 +196,7 @@ class Tracker(object):
         if gaze_sample["left_gaze_point_validity"] and gaze_sample["right_gaze_point_validity"]:
             left_sample = self._norm_2_px(gaze_sample["left_gaze_point_on_display_area"])
             right_sample = self._norm_2_px(gaze_sample["right_gaze_point_on_display_area"])
-            return (self._mean([left_sample[0], right_sample[0]]), self._mean([left_sample[1], right_sample[1]]))
+            return (mean([left_sample[0], right_sample[0]]), mean([left_sample[1], right_sample[1]]))
         if gaze_sample["left_gaze_point_validity"]:
             return self._norm_2_px(gaze_sample["left_gaze_point_on_display_area"])
         if gaze_sample["right_gaze_point_validity"]:
@@ -144,70 +205,65 @@ class Tracker(object):
     
     def pupil_size(self, gaze_sample):
         pupil_data = self.INVALID
-        if gaze_sample:
+        if gaze_sample is not None:
             if gaze_sample["left_pupil_validity"] and gaze_sample["right_pupil_validity"]:
-                pupil_data = self._mean([gaze_sample["left_pupil_diameter"], gaze_sample["right_pupil_diameter"]])
+                pupil_data = mean([gaze_sample["left_pupil_diameter"], gaze_sample["right_pupil_diameter"]])
             if gaze_sample["left_pupil_validity"]:
                 pupil_data = gaze_sample["left_pupil_diameter"]
             if gaze_sample["right_pupil_validity"]:
                 pupil_data = gaze_sample["right_pupil_diameter"]
         return pupil_data
 
+    def in_saccade(self):
+        return self.movement == SACCADE
+
     def sample(self):
-        gaze_sample = self.gaze_data[-1]
-        t = self.millis()
+        gaze_sample = self.gaze_data.latest()
+        t = self.timebase.sample_time(gaze_sample['system_time_stamp'])
         x, y = self.gaze_point(gaze_sample)
         d = self.pupil_size(gaze_sample)
         return (t, x, y, d)
 
-    def wait_for_fixation_start(self):
-        params = self.config
-        pxfixtresh = params['pxfixtresh']
-        fixtimetresh = params['fixtimetresh']
-
-        spos = self.sample()
-        while not self.is_valid_sample((spos[1],spos[2])):
-            spos = self.sample()
-
-        t0 = spos[0]
-        sx, sy = spos[1], spos[2]
-
-        while True:
-            npos = data_generator.__next__()
-            nx, ny = npos[1], npos[2]
-            if self.is_valid_sample((nx, ny)):
-                # check if new sample is too far from starting position
-                if (nx - sx)**2 + (ny - sy)**2 > pxfixtresh**2:  # Pythagoras
-                    # if not, reset starting position and time
-                    sx, sy = nx, ny
-                    t0 = npos[0]
-                # if new sample is close to starting sample
-                else:
-                    # get timestamp
-                    t1 = npos[0]
-                    # check if fixation time threshold has been surpassed
-                    if t1 - t0 >= fixtimetresh:
-                        # return time and starting position
-
-                        return t0, sx, sy
-
-    def get_fixation_point(self, data_generator):
-        params = self.config
-        pxfixtresh = params['pxfixtresh']
-
-        stime, sx, sy = self.wait_for_fixation_start(data_generator)
-        etime = None
-        while True:
-            # get new sample from the samples.csv file
-            npos = data_generator.__next__()
-            nx, ny = npos[1], npos[2]
-            # check if sample is valid
-            if self.is_valid_sample((npos[1],npos[2])):
-                # check if sample deviates to much from starting position
-                if (nx - sx)**2 + (ny - sy)**2 > pxfixtresh**2:
-                    # break loop if deviation is too high
-                    etime = npos[0]
-                    break
-
-        return stime, etime, sx, sy
+    def samples(self, timeout=None):
+        # every new sample exactly once, in the same form as sample(); blocks in between
+        for gaze_sample in self.gaze_data.samples(timeout=timeout):
+            x, y = self.gaze_point(gaze_sample)
+            d = self.pupil_size(gaze_sample)
+            yield (self.timebase.sample_time(gaze_sample['system_time_stamp']), x, y, d)
 
+    def wait_for_fixation_event(self, kind, timeout=None):
+        """
+        Block until the fixation detector emits an event of `kind`.
+        Returns the FixationEvent, or None after `timeout` seconds.
+        """
+        events = Queue()
+
+        def on_event(event):
+            if event.kind == kind:
+                events.put(event)
+
+        self.fixation_detector.subscribe(on_event)
+        try:
+            return events.get(timeout=timeout)
+        except Empty:
+            return None
+        finally:
+            self.fixation_detector.unsubscribe(on_event)
+
+    def wait_for_fixation_start(self, timeout=None):
+        event = self.wait_for_fixation_event(FIXATION_START, timeout)
+        if event is None:
+            return None
+        return event.stime, event.x, event.y
+
+    def get_fixation_point(self, timeout=None):
+        event = self.wait_for_fixation_event(FIXATION_END, timeout)
+        if event is None:
+            return None
+        return event.stime, event.etime, event.x, event.y
+
+    def wait_for_dwell(self, timeout=None):
+        event = self.wait_for_fixation_event(DWELL, timeout)
+        if event is None:
+            return None
+        return event.stime, event.etime, event.x, event.y
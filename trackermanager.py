@@ -0,0 +1,88 @@
+import constants as c
+
+from collections import OrderedDict
+
+from calibrate import calibrate_user
+from sharedgaze import GazeProcess
+from tracker import Tracker
+import backend
+
+tr = backend.load_backend()
+
+
+def find_eyetrackers(serials=None):
+    '''
+    Connected eye trackers: all of them, or those with the given serial
+    numbers in that order. Raises ValueError if one of them is missing.
+    '''
+    found = tr.find_all_eyetrackers()
+    if serials is None:
+        return list(found)
+    by_serial = dict((eyetracker.serial_number, eyetracker) for eyetracker in found)
+    missing = [serial for serial in serials if serial not in by_serial]
+    if missing:
+        raise ValueError('eye trackers %s not found, connected: %s' % (', '.join(missing), ', '.join(by_serial)))
+    return [by_serial[serial] for serial in serials]
+
+
+class TrackerManager(object):
+    '''
+    One Tracker per player, each on its own eye tracker.
+
+    The n-th user gets the n-th tracker of `serials` (default: every
+    connected tracker, in the order the SDK lists them). Each Tracker has
+    its own gaze buffer, cached calibration and fixation pipeline, and the
+    SDK delivers every device's samples on that device's own callback
+    thread. With `process` every Tracker runs in a GazeProcess instead, so
+    the devices do not even share an interpreter.
+
+    Trackers load their user's calibration, so `open()` them (or
+    `start_recording()`) after `calibrate()`. Iterating gives the trackers in
+    player order; index them by serial number.
+    '''
+    def __init__(self, users, serials=c.TRACKERSERIALNUMBERS, process=c.CAPTUREPROCESS):
+        eyetrackers = find_eyetrackers(serials)
+        if len(eyetrackers) < len(users):
+            raise ValueError('%d players but only %d eye trackers' % (len(users), len(eyetrackers)))
+
+        self.users = list(users)
+        self.eyetrackers = eyetrackers[:len(self.users)]
+        self.process = process
+        self.trackers = OrderedDict()
+
+    def open(self):
+        for user, eyetracker in zip(self.users, self.eyetrackers):
+            if eyetracker.serial_number in self.trackers:
+                continue
+            if self.process:
+                tracker = GazeProcess(user, serial=eyetracker.serial_number)
+            else:
+                tracker = Tracker(user, eyetracker=eyetracker)
+            self.trackers[eyetracker.serial_number] = tracker
+
+    def __len__(self):
+        return len(self.trackers)
+
+    def __iter__(self):
+        return iter(self.trackers.values())
+
+    def __getitem__(self, serial):
+        return self.trackers[serial]
+
+    @property
+    def serials(self):
+        return list(self.trackers)
+
+    def calibrate(self, force=False):
+        # one after the other: calibration needs the screen to itself
+        return all([calibrate_user(user, force, eyetracker)
+                    for user, eyetracker in zip(self.users, self.eyetrackers)])
+
+    def start_recording(self):
+        self.open()
+        for tracker in self:
+            tracker.start_recording()
+
+    def stop_recording(self):
+        for tracker in self:
+            tracker.stop_recording()
@@ -0,0 +1,106 @@
+import constants as c
+
+from collections import deque
+
+import numpy as np
+import math
+
+# sample labels
+FIXATION = 0
+SACCADE = 1
+BLINK = 2
+
+# Speed is measured over `window` milliseconds rather than from one sample to
+# the next: sample i is compared with the newest sample at least `window` ms
+# older, and its acceleration is the change from that sample's speed. Until
+# gaze has been tracked for `window` ms (at the start and after gaze was
+# lost) there is no such sample and the label is FIXATION. Sample-to-sample
+# differences grow with the sample rate as the noise stays the same size
+# while the interval shrinks, so at 600 Hz most fixation samples would look
+# like saccades.
+
+
+def classify(t, x, y, pxspdtresh, pxacctresh, valid=None, window=c.VELOCITYWINDOW):
+    '''
+    Velocity/acceleration threshold (I-VT) classification of a whole
+    recording in one vectorized pass.
+
+    param `t`: system_time_stamp column, in microseconds
+    param `x`, `y`: gaze position in pixels, NaN where there is no gaze
+    param `pxspdtresh`: saccade velocity threshold in pixels/ms
+    param `pxacctresh`: saccade acceleration threshold in pixels/ms**2
+    param `valid`: optional boolean mask; defaults to the finite samples
+    param `window`: milliseconds over which speed is measured
+
+    Returns an int8 array with FIXATION, SACCADE or BLINK per sample.
+    '''
+    t = np.asarray(t, dtype=np.float64) / 1000.0
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if valid is None:
+        valid = np.isfinite(x) & np.isfinite(y)
+
+    labels = np.full(len(t), FIXATION, dtype=np.int8)
+    if len(t) > 1:
+        index = np.arange(len(t))
+        # first sample of the run of valid samples each sample belongs to
+        start = np.maximum.accumulate(np.where(valid, -1, index)) + 1
+        reference = np.searchsorted(t, t - window, side='right') - 1
+        moving = valid & (reference >= start)
+        reference = np.where(moving, reference, index)
+        dt = t - t[reference]
+
+        speed = np.full(len(t), np.nan)
+        ref = reference[moving]
+        speed[moving] = np.hypot(x[moving] - x[ref], y[moving] - y[ref]) / dt[moving]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            acceleration = np.abs(speed - speed[reference]) / dt
+            saccade = (speed > pxspdtresh) | (acceleration > pxacctresh)
+        labels[saccade] = SACCADE
+    labels[~valid] = BLINK
+    return labels
+
+
+class VelocityClassifier(object):
+    '''
+    Streaming form of `classify()` for live play: feed one sample at a time
+    and get its label back. Gives the same labels as the bulk form, keeping
+    only the samples of the last `window` milliseconds.
+    '''
+    def __init__(self, pxspdtresh, pxacctresh, window=c.VELOCITYWINDOW):
+        self.pxspdtresh = pxspdtresh
+        self.pxacctresh = pxacctresh
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        # (t, x, y, speed) since gaze was last lost, from the reference sample on
+        self._history = deque()
+
+    def feed(self, t, x, y):
+        '''
+        param `t`: system_time_stamp in microseconds; pass NaN for x/y when
+        there is no gaze
+        '''
+        if not (math.isfinite(x) and math.isfinite(y)):
+            self.reset()
+            return BLINK
+
+        t = t / 1000.0
+        history = self._history
+        while len(history) > 1 and history[1][0] <= t - self.window:
+            history.popleft()
+
+        label = FIXATION
+        speed = None
+        if history and history[0][0] <= t - self.window:
+            rt, rx, ry, rspeed = history[0]
+            dt = t - rt
+            speed = math.hypot(x - rx, y - ry) / dt
+            if speed > self.pxspdtresh:
+                label = SACCADE
+            elif rspeed is not None and abs(speed - rspeed) / dt > self.pxacctresh:
+                label = SACCADE
+
+        history.append((t, x, y, speed))
+        return label